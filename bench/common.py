@@ -0,0 +1,148 @@
+"""Helpers for the benchmarks that run the app
+
+The benchmarks are run from the root of the repository with the package
+importable (e.g. after ``pip install -e .``)::
+
+    python bench/<name>.py --help
+
+They don't talk to Spotify: :class:`FakeSpotify` answers every call after a
+fixed delay.
+
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import aiohttp
+from aiohttp_spotify import SpotifyAuth, SpotifyResponse
+from cryptography import fernet
+
+from spotify_party import codec, create_tables
+
+# A user as (user_id, playing_to, listening_to, paused)
+UserRow = Tuple[str, Optional[str], Optional[str], int]
+
+
+def make_config(directory: str, session_key: str, **kwargs) -> Dict[str, Any]:
+    """A config for a new database in ``directory``
+
+    Only the options that every version of the app understands are set so
+    that the same config can be used to measure an older checkout.
+
+    """
+    database_filename = os.path.join(directory, "bench.db")
+    create_tables(database_filename)
+    return dict(
+        spotify_client_id="bench",
+        spotify_client_secret="bench",
+        spotify_redirect_uri="http://localhost/spotify/callback",
+        base_url="http://localhost",
+        database_filename=database_filename,
+        session_key=session_key,
+        **kwargs,
+    )
+
+
+def temporary_directory() -> tempfile.TemporaryDirectory:
+    return tempfile.TemporaryDirectory(prefix="spotify-party-bench-")
+
+
+def add_users(database_filename: str, users: Iterable[UserRow]) -> None:
+    """Add users whose access token and device id are derived from their id"""
+    expires_at = int(time.time()) + 86400
+    with sqlite3.connect(database_filename) as connection:
+        connection.executemany(
+            """
+            INSERT INTO users(
+                user_id, display_name, access_token, refresh_token,
+                expires_at, playing_to, listening_to, paused, device_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    user_id,
+                    user_id,
+                    user_id,
+                    "bench",
+                    expires_at,
+                    playing_to,
+                    listening_to,
+                    paused,
+                    f"device-{user_id}",
+                )
+                for user_id, playing_to, listening_to, paused in users
+            ],
+        )
+
+
+def session_cookie(session_key: str, user_id: str) -> str:
+    """The value of the session cookie for a user"""
+    data = {"created": int(time.time()), "session": {"sp_user_id": user_id}}
+    return (
+        fernet.Fernet(session_key.encode("utf-8"))
+        .encrypt(codec.dumps_bytes(data))
+        .decode("utf-8")
+    )
+
+
+class FakeSpotify:
+    """A Spotify client that answers every call after ``delay`` seconds
+
+    Every device is active and the same track is always playing.
+
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def update_auth(
+        self, session: aiohttp.ClientSession, auth: SpotifyAuth
+    ) -> SpotifyAuth:
+        return SpotifyAuth(
+            auth.access_token, auth.refresh_token, int(time.time()) + 3600
+        )
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        auth: SpotifyAuth,
+        endpoint: str,
+        *,
+        method: str = "GET",
+        **payload,
+    ) -> SpotifyResponse:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        body = b""
+        if endpoint == "/me/player/currently-playing":
+            body = codec.dumps_bytes(
+                {
+                    "item": {
+                        "uri": "spotify:track:bench",
+                        "name": "Bench",
+                        "type": "track",
+                        "id": "bench",
+                        "duration_ms": 200_000,
+                    },
+                    "context": None,
+                    "progress_ms": 1000,
+                    "is_playing": True,
+                }
+            )
+        elif endpoint == "/me/player/devices":
+            body = codec.dumps_bytes(
+                {
+                    "devices": [
+                        {
+                            "id": f"device-{auth.access_token}",
+                            "is_active": True,
+                        }
+                    ]
+                }
+            )
+        return SpotifyResponse(False, auth, 200 if body else 204, {}, body)
@@ -0,0 +1,136 @@
+"""The throughput of /api/listen/sync with asyncio's and uvloop's loops
+
+Usage::
+
+    python bench/event_loop.py [--listeners 200] [--syncs 25] [--runs 2]
+
+This starts the app in a separate process for each run, alternating
+between the default asyncio loop and uvloop (which must be installed),
+with a fake Spotify client that answers after 5 ms. ``--listeners``
+listeners of a single room each send ``--syncs`` sync requests, all
+concurrently, and the requests per second and the median and 99th
+percentile latencies are reported.
+
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+import aiohttp
+
+HOST = "host"
+ROOM = f"{HOST}/room"
+
+
+def serve(args: argparse.Namespace) -> None:
+    if args.loop == "uvloop":
+        import uvloop
+
+        uvloop.install()
+
+    from aiohttp import web
+    from common import FakeSpotify, add_users, make_config, temporary_directory
+
+    from spotify_party import app_factory
+    from spotify_party.config import validate_config
+
+    with temporary_directory() as directory:
+        config = make_config(
+            directory,
+            args.key,
+            admission_control=False,
+            presence_sweep_interval=0.0,
+        )
+        add_users(
+            config["database_filename"],
+            [(HOST, ROOM, None, 0)]
+            + [(f"listener{i}", None, ROOM, 0) for i in range(args.listeners)],
+        )
+        app = app_factory(validate_config(config))
+        app["spotify_app"]["spotify_client"] = FakeSpotify(delay=0.005)
+        print("ready", flush=True)
+        web.run_app(app, host="127.0.0.1", port=args.port, print=None)
+
+
+async def sync(args: argparse.Namespace) -> Tuple[float, float, float]:
+    from common import session_cookie
+
+    url = f"http://127.0.0.1:{args.port}/api/listen/sync"
+    cookies = [
+        session_cookie(args.key, f"listener{i}") for i in range(args.listeners)
+    ]
+    latencies: List[float] = []
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0)
+    ) as session:
+
+        async def listener(i: int) -> None:
+            for _ in range(args.syncs):
+                start = time.perf_counter()
+                async with session.post(
+                    url,
+                    json={"device_id": f"device-listener{i}"},
+                    cookies={"AIOHTTP_SESSION": cookies[i]},
+                ) as response:
+                    await response.read()
+                    assert response.status == 200, response.status
+                latencies.append(time.perf_counter() - start)
+
+        await listener(0)
+        latencies.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(listener(i) for i in range(args.listeners)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        1e3 * latencies[len(latencies) // 2],
+        1e3 * latencies[int(0.99 * len(latencies))],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listeners", type=int, default=200)
+    parser.add_argument("--syncs", type=int, default=25)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--loop", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--key", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    from cryptography import fernet
+
+    args.key = fernet.Fernet.generate_key().decode("utf-8")
+    for _ in range(args.runs):
+        for loop in ("asyncio", "uvloop"):
+            command = [sys.executable, __file__, "--serve", "--loop", loop]
+            for name in ("listeners", "port", "key"):
+                command += [f"--{name}", str(getattr(args, name))]
+            server = subprocess.Popen(command, stdout=subprocess.PIPE)
+            try:
+                assert server.stdout is not None
+                server.stdout.readline()
+                time.sleep(0.5)
+                rate, p50, p99 = asyncio.run(sync(args))
+            finally:
+                server.terminate()
+                server.wait()
+            print(
+                f"{loop:<8} {rate:5.0f} req/s"
+                f"  p50 {p50:6.0f} ms  p99 {p99:6.0f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
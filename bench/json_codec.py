@@ -0,0 +1,95 @@
+"""The cost of decoding and validating an API request body
+
+Usage::
+
+    python bench/json_codec.py [--number 200000] [--repeat 5]
+
+This times the ``/api/broadcast/change`` body (all seven fields) through:
+
+- the stdlib decoder and the dictionary loop that ``endpoint`` used before
+  the field specification was compiled (reproduced here);
+- the stdlib decoder and :class:`spotify_party.api.FieldValidator`;
+- :mod:`spotify_party.codec` (orjson or ujson if installed) and the
+  validator;
+
+and the encoding of a ``/api/listen/sync`` response with the stdlib (as
+``web.json_response`` does) and with the codec. The results are the best
+of ``--repeat`` runs in microseconds per body.
+
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any, Callable, Dict, Mapping
+
+from spotify_party import codec
+from spotify_party.api import FieldValidator
+
+REQUIRED = dict(uri=str, name=str, type=str, id=str)
+OPTIONAL = dict(position_ms=int, duration_ms=int, context_uri=str)
+
+BODY = json.dumps(
+    {
+        "uri": "spotify:track:6rqhFgbbKwnb9MLmUQDhG6",
+        "name": "Speak to Me - 2011 Remastered",
+        "type": "track",
+        "id": "6rqhFgbbKwnb9MLmUQDhG6",
+        "position_ms": 61000,
+        "duration_ms": 67000,
+        "context_uri": "spotify:album:4LH4d3cOWNNsVw41Gqt2kv",
+    }
+).encode("utf-8")
+
+RESPONSE = {
+    "number": 12,
+    "playing": dict(json.loads(BODY), is_playing=True),
+}
+
+
+def validate_before(
+    original_data: Dict[str, Any],
+    required_data: Mapping[str, Callable] = REQUIRED,
+    optional_data: Mapping[str, Callable] = OPTIONAL,
+) -> Dict[str, Any]:
+    data: Dict[str, Any] = dict()
+    for key, mapper in required_data.items():
+        if key not in original_data:
+            raise ValueError(key)
+        data[key] = mapper(original_data.pop(key))
+    for key, value in original_data.items():
+        if key not in optional_data:
+            raise ValueError(key)
+        data[key] = optional_data[key](value)
+    return data
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    validate = FieldValidator(REQUIRED, OPTIONAL)
+    assert validate(json.loads(BODY)) == validate_before(json.loads(BODY))
+
+    cases = [
+        (
+            "decode: json + dict loop",
+            lambda: validate_before(json.loads(BODY)),
+        ),
+        ("decode: json + FieldValidator", lambda: validate(json.loads(BODY))),
+        (
+            f"decode: {codec.NAME} + FieldValidator",
+            lambda: validate(codec.loads(BODY)),
+        ),
+        ("encode: json.dumps", lambda: json.dumps(RESPONSE).encode("utf-8")),
+        (f"encode: {codec.NAME}", lambda: codec.dumps_bytes(RESPONSE)),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        print(f"{name:<32} {1e6 * best / args.number:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""The cost of recording a metric on the hot path
+
+Usage::
+
+    python bench/metrics_overhead.py [--number 1000000] [--repeat 5]
+
+This times ``Histogram.observe`` and ``Counter.inc`` with a label set that
+already exists (the common case) against an empty call with the same
+arguments, and reports the best of ``--repeat`` runs in microseconds per
+call. A request through the API records one route latency and usually one
+or two database and Spotify latencies.
+
+"""
+
+import argparse
+import timeit
+
+from spotify_party.metrics import Counter, Histogram
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    histogram = Histogram(
+        "bench_seconds", "", ("route", "method", "status"), register=False
+    )
+    counter = Counter(
+        "bench_total", "", ("route", "method", "status"), register=False
+    )
+    labels = ("listen.sync", "POST", "200")
+    histogram.observe(0.01, labels)
+    counter.inc(labels)
+
+    def empty(value, labels=()):
+        pass
+
+    cases = [
+        ("empty call", lambda: empty(0.0123, labels)),
+        ("Histogram.observe", lambda: histogram.observe(0.0123, labels)),
+        ("Counter.inc", lambda: counter.inc(labels)),
+    ]
+    baseline = None
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        per_call = 1e6 * best / args.number
+        if baseline is None:
+            baseline = per_call
+            print(f"{name:<20} {per_call:6.3f} us per call")
+        else:
+            print(
+                f"{name:<20} {per_call:6.3f} us per call "
+                f"({per_call - baseline:.3f} us over an empty call)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""The size and encoding cost of the "changed" broadcasts
+
+Usage::
+
+    python bench/room_updates.py [--clients 2000]
+
+A room with ``--clients`` connected sids gets 15 seeks and then a track
+change, which is what a host's player typically reports. The events are
+sent in two ways:
+
+- before: the full state is emitted to each sid separately (which is what
+  python-socketio's manager did for a room broadcast);
+- after: :class:`spotify_party.updates.RoomUpdates` deltas are broadcast
+  once through :class:`spotify_party.socket.BroadcastManager`.
+
+The engine.io transport is replaced by a counter so this measures the
+bytes queued per client and the CPU time per broadcast, not the network.
+
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from spotify_party.socket import sio
+from spotify_party.updates import RoomUpdates
+
+TRACK = {
+    "uri": "spotify:track:6rqhFgbbKwnb9MLmUQDhG6",
+    "name": "Speak to Me - 2011 Remastered",
+    "type": "track",
+    "id": "6rqhFgbbKwnb9MLmUQDhG6",
+    "position_ms": 0,
+    "duration_ms": 67000,
+    "context_uri": "spotify:album:4LH4d3cOWNNsVw41Gqt2kv",
+}
+
+
+def host_events(clients: int) -> List[Dict[str, Any]]:
+    events = []
+    for k in range(16):
+        playing = dict(TRACK, position_ms=1000 * k)
+        if k == 15:
+            playing.update(uri="spotify:track:x", id="x", name="Breathe")
+        events.append({"number": clients, "playing": playing})
+    return events
+
+
+async def run(clients: int) -> None:
+    sent = {"packets": 0, "bytes": 0}
+
+    async def send(sid: str, data: Any, binary: bool = False) -> None:
+        sent["packets"] += 1
+        sent["bytes"] += len(data)
+
+    sio.eio.send = send
+    sids = [f"sid{i}" for i in range(clients)]
+    for sid in sids:
+        sio.manager.connect(sid, "/")
+        sio.manager.enter_room(sid, "/", "room")
+    events = host_events(clients)
+
+    async def before() -> None:
+        for event in events:
+            for sid in sids:
+                await sio._emit_internal(sid, "changed", event, "/")
+
+    async def after() -> None:
+        updates = RoomUpdates()
+        for event in events:
+            await sio.manager.emit(
+                "changed", updates.update("room", event), "/", room="room"
+            )
+
+    for name, func in (("before", before), ("after", after)):
+        sent.update(packets=0, bytes=0)
+        start = time.process_time()
+        await func()
+        elapsed = time.process_time() - start
+        print(
+            f"{name}: {sent['bytes'] / sent['packets']:.0f} bytes/event/client"
+            f", {1e3 * elapsed / len(events):.1f} ms CPU per broadcast"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.clients))
+
+
+if __name__ == "__main__":
+    main()
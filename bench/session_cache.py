@@ -0,0 +1,103 @@
+"""The cost of authenticating a request from its session cookie
+
+Usage::
+
+    python bench/session_cache.py [--number 5000]
+
+This runs a ``require_auth`` handler on a mocked request with a valid
+session cookie, using a stub database, with aiohttp_session's
+``EncryptedCookieStorage`` and with
+:class:`spotify_party.sessions.CachedEncryptedCookieStorage`. Each run is
+repeated twice and the second one is reported (in microseconds per call).
+
+"""
+
+import argparse
+import asyncio
+import base64
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from aiohttp_session import SESSION_KEY, STORAGE_KEY
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from cryptography import fernet
+
+from spotify_party import codec
+from spotify_party.auth import require_auth
+from spotify_party.sessions import CachedEncryptedCookieStorage
+
+
+class StubUser:
+    async def __aenter__(self) -> "StubUser":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def update_auth(self, request: web.Request) -> None:
+        pass
+
+
+class StubDatabase:
+    async def get_user(self, user_id):
+        return None if user_id is None else StubUser()
+
+
+@require_auth(redirect=False)
+async def handler(request: web.Request, user: StubUser) -> StubUser:
+    return user
+
+
+async def run(number: int) -> None:
+    key = fernet.Fernet.generate_key()
+    cookie = (
+        fernet.Fernet(key)
+        .encrypt(
+            codec.dumps_bytes(
+                {"created": int(time.time()), "session": {"sp_user_id": "u"}}
+            )
+        )
+        .decode("utf-8")
+    )
+    app = web.Application()
+    app["db"] = StubDatabase()
+
+    secret = base64.urlsafe_b64decode(key)
+    for storage in (
+        EncryptedCookieStorage(secret),
+        CachedEncryptedCookieStorage(secret),
+    ):
+        request = make_mocked_request(
+            "GET",
+            "/",
+            headers={"Cookie": f"AIOHTTP_SESSION={cookie}"},
+            app=app,
+        )
+        request[STORAGE_KEY] = storage
+
+        async def once():
+            request.pop(SESSION_KEY, None)
+            return await handler(request)
+
+        assert await once() is not None
+        for _ in range(2):
+            start = time.perf_counter()
+            for _ in range(number):
+                await once()
+            elapsed = time.perf_counter() - start
+        print(
+            f"{type(storage).__name__:<30} "
+            f"{1e6 * elapsed / number:6.1f} us per call"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""The memory held by the server for each connected socket.io client
+
+Usage::
+
+    python bench/socket_memory.py [--clients 1000] [--transport websocket]
+        [--src PATH]
+
+This starts the app in a separate process with ``tracemalloc`` enabled,
+connects ``--clients`` authenticated socket.io clients over the given
+transport (``websocket`` or ``polling``), waits for them to settle, and
+reports the traced memory per client. To measure another version of the
+app, check it out somewhere (e.g. with ``git worktree add``) and pass its
+``src`` directory as ``--src``.
+
+"""
+
+import argparse
+import asyncio
+import gc
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+
+
+def serve(args: argparse.Namespace) -> None:
+    if args.src is not None:
+        sys.path.insert(0, args.src)
+    tracemalloc.start()
+
+    from aiohttp import web
+    from common import add_users, make_config, temporary_directory
+
+    from spotify_party import app_factory
+    from spotify_party.config import validate_config
+
+    async def memory(request: web.Request) -> web.Response:
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        return web.json_response({"traced": current})
+
+    with temporary_directory() as directory:
+        config = make_config(directory, args.key)
+        add_users(
+            config["database_filename"],
+            [(f"user{i}", None, None, 1) for i in range(args.clients)],
+        )
+        app = app_factory(validate_config(config))
+        app.router.add_get("/_bench/memory", memory)
+        print("ready", flush=True)
+        web.run_app(app, host="127.0.0.1", port=args.port, print=None)
+
+
+async def connect(args: argparse.Namespace) -> float:
+    from common import session_cookie
+
+    base = f"http://127.0.0.1:{args.port}"
+    url = f"{base}/socket.io/?EIO=3&transport={args.transport}"
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0)
+    ) as session:
+
+        async def traced() -> int:
+            async with session.get(f"{base}/_bench/memory") as response:
+                return (await response.json())["traced"]
+
+        before = await traced()
+        sockets = []
+        for i in range(args.clients):
+            headers = {
+                "Cookie": "AIOHTTP_SESSION="
+                + session_cookie(args.key, f"user{i}"),
+                "Origin": base,
+            }
+            if args.transport == "polling":
+                async with session.get(url, headers=headers) as response:
+                    assert b"40" in await response.read()
+            else:
+                ws = await session.ws_connect(url, headers=headers)
+                await ws.receive()
+                message = await ws.receive()
+                assert message.data.startswith("40"), message.data
+                sockets.append(ws)
+
+        await asyncio.sleep(0.5)
+        after = await traced()
+        for ws in sockets:
+            await ws.close()
+    return (after - before) / args.clients
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--transport", choices=("websocket", "polling"), default="websocket"
+    )
+    parser.add_argument("--src", type=str, default=None)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--key", type=str, default=None, help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    from cryptography import fernet
+
+    args.key = fernet.Fernet.generate_key().decode("utf-8")
+    command = [sys.executable, __file__, "--serve"]
+    for name in ("clients", "port", "key", "src"):
+        if getattr(args, name) is not None:
+            command += [f"--{name}", str(getattr(args, name))]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        assert server.stdout is not None
+        server.stdout.readline()
+        time.sleep(0.5)
+        per_client = asyncio.run(connect(args))
+    finally:
+        server.terminate()
+        server.wait()
+    print(
+        f"{args.clients} {args.transport} clients: "
+        f"{per_client / 1024:.1f} KiB traced per client"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -32,8 +32,29 @@ interface AppState {
   error?: Error;
 }
 
+interface RoomUpdate {
+  number: number;
+  playing?: TrackInfo;
+}
+
+function applyDelta(state: RoomUpdate, delta: any): RoomUpdate {
+  const updated = { ...state };
+  if (delta.number !== undefined) updated.number = delta.number;
+  if (delta.playing === null) {
+    updated.playing = undefined;
+  } else if (delta.playing !== undefined) {
+    const playing: any = { ...state.playing, ...delta.playing };
+    for (const key of Object.keys(delta.playing)) {
+      if (delta.playing[key] === null) delete playing[key];
+    }
+    updated.playing = playing;
+  }
+  return updated;
+}
+
 class App extends React.Component<AppProps, AppState> {
   socket: SocketIOClient.Socket;
+  roomVersion?: number;
   player: Spotify.SpotifyPlayer;
   api: API;
 
@@ -65,7 +86,16 @@ class App extends React.Component<AppProps, AppState> {
   }
 
   connectSocket() {
-    this.socket = io.connect();
+    // Connect straight to the websocket transport, but fall back to polling
+    // (which then upgrades if it can) if the websocket never connects
+    let connected = false;
+    this.socket = io.connect({ transports: ["websocket"] });
+    this.socket.on("connect", () => (connected = true));
+    this.socket.on("connect_error", () => {
+      if (!connected) {
+        this.socket.io.opts.transports = ["polling", "websocket"];
+      }
+    });
     this.socket.on("listeners", (data: any) => {
       this.setState({ listeners: data.number });
     });
@@ -75,10 +105,26 @@ class App extends React.Component<AppProps, AppState> {
         this.state.status == Status.Loading
       )
         return;
+
+      // The updates are deltas against the previous version except for the
+      // keyframes; if we missed one, ask for the full state
+      let update: RoomUpdate;
+      if (data.key) {
+        update = { number: data.number, playing: data.playing };
+      } else if (data.base === this.roomVersion) {
+        update = applyDelta(
+          { number: this.state.listeners, playing: this.state.currentTrack },
+          data
+        );
+      } else {
+        this.socket.emit("resync", this.getRoomId());
+        return;
+      }
+      this.roomVersion = data.v;
       this.setState({
         status: Status.Streaming,
-        listeners: data.number,
-        currentTrack: data.playing,
+        listeners: update.number,
+        currentTrack: update.playing,
         isPaused: false,
       });
     });
@@ -185,7 +231,11 @@ class App extends React.Component<AppProps, AppState> {
       type: track.type,
       name: track.name,
       id: track.id,
+      duration_ms: track.duration_ms,
     };
+    if (state.context && state.context.uri) {
+      data.context_uri = state.context.uri;
+    }
 
     // Work out if this is a change
     if (state.paused && !this.state.isPaused) {
@@ -11,6 +11,8 @@ export interface TrackInfo {
   type: string;
   id: string;
   position_ms?: number;
+  duration_ms?: number;
+  context_uri?: string;
 }
 
 export interface Error {
@@ -1,11 +1,27 @@
 __all__ = ["app_factory", "create_tables", "get_config"]
 
-from .app import app_factory
-from .config import get_config
-from .db import create_tables
+from typing import Any
 
 __uri__ = "https://github.com/dfm/spotify-party"
 __author__ = "Daniel Foreman-Mackey"
 __email__ = "foreman.mackey@gmail.com"
 __license__ = "MIT"
 __description__ = "Listen to music with your friends"
+
+
+def __getattr__(name: str) -> Any:
+    # Import the submodules lazily so that the entry points (and tools like
+    # the table setup) don't pay for importing the whole web stack
+    if name == "app_factory":
+        from .app import app_factory
+
+        return app_factory
+    if name == "create_tables":
+        from .db import create_tables
+
+        return create_tables
+    if name == "get_config":
+        from .config import get_config
+
+        return get_config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,23 +1,55 @@
 import argparse
 import sqlite3
 
-from aiohttp import web
-
-from spotify_party import app_factory, create_tables, get_config
+from spotify_party import get_config
 
 parser = argparse.ArgumentParser()
 parser.add_argument("config_file", type=str)
 parser.add_argument("--create-tables", action="store_true")
+parser.add_argument(
+    "--compile-templates",
+    action="store_true",
+    help="compile the templates into the 'compiled_templates' directory",
+)
+parser.add_argument(
+    "--uvloop",
+    action="store_true",
+    help="run the server on uvloop (if it is installed)",
+)
 args = parser.parse_args()
 
 config = get_config(args.config_file)
 
 
 if args.create_tables:
+    from spotify_party import create_tables
+
     try:
         create_tables(config["database_filename"])
     except sqlite3.OperationalError:
         print("Tables already exist")
 
+elif args.compile_templates:
+    from spotify_party.app import get_resource_path
+    from spotify_party.rendering import compile_templates
+
+    if not config["compiled_templates"]:
+        parser.error("'compiled_templates' must be set in the config file")
+    count = compile_templates(
+        get_resource_path("templates"), config["compiled_templates"]
+    )
+    print(f"Compiled {count} templates")
+
 else:
+    from aiohttp import web
+
+    from spotify_party import app_factory
+
+    if args.uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            parser.error("'--uvloop' requires the uvloop package")
+        uvloop.install()
+
     web.run_app(app_factory(config), port=config["port"])
@@ -0,0 +1,216 @@
+__all__ = ["AdmissionControl", "admission_middleware", "priority_for"]
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Mapping, Optional
+
+from aiohttp import hdrs, web
+
+from . import codec
+from .metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    ADMISSION_SHED,
+    ADMISSION_WAIT,
+)
+
+CRITICAL = "critical"
+NORMAL = "normal"
+LOW = "low"
+PRIORITIES = (CRITICAL, NORMAL, LOW)
+
+# The priority class of each named route; the routes that aren't listed are
+# NORMAL and the routes without a name (the socket.io endpoint) or listed as
+# None aren't limited at all
+ROUTE_PRIORITIES: Mapping[str, Optional[str]] = {
+    # The host's player and the token refresh are cheap and a delay is
+    # audible in every room
+    "interface.me": CRITICAL,
+    "interface.token": CRITICAL,
+    "broadcast.change": CRITICAL,
+    "broadcast.pause": CRITICAL,
+    "broadcast.stop": CRITICAL,
+    "listen.stop": CRITICAL,
+    # Each client polls these and a late response is harmless
+    "listen.sync": LOW,
+    "interface.rooms": LOW,
+    "index": LOW,
+    "about": LOW,
+    "premium": LOW,
+    "play": LOW,
+    "listen": LOW,
+    "listen_index": LOW,
+    # These are needed to see what's going on
+    "metrics": None,
+    "assets": None,
+}
+
+# How long (in seconds) the clients should wait before retrying
+RETRY_AFTER = 2
+
+
+def priority_for(name: Optional[str]) -> Optional[str]:
+    """The priority class for a route name or None if it isn't limited"""
+    if name is None:
+        return None
+    return ROUTE_PRIORITIES.get(name, NORMAL)
+
+
+class PriorityClass:
+    """A concurrency limit with a bounded queue of waiting requests
+
+    The requests are admitted in the order that they arrived and a request
+    that finishes hands its slot directly to the next waiting one.
+
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.wait = wait
+        self.in_flight = 0
+        self.shed = 0
+        self._waiters: Deque["asyncio.Future[bool]"] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _update_gauges(self) -> None:
+        ADMISSION_IN_FLIGHT.set(self.in_flight, (self.name,))
+        ADMISSION_QUEUED.set(len(self._waiters), (self.name,))
+
+    def _shed(self, reason: str) -> bool:
+        self.shed += 1
+        ADMISSION_SHED.inc((self.name, reason))
+        return False
+
+    async def acquire(self) -> bool:
+        """Wait for a slot
+
+        Returns:
+            False if the queue was full or the wait timed out
+
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._update_gauges()
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return self._shed("queue_full")
+
+        loop = asyncio.get_event_loop()
+        waiter: "asyncio.Future[bool]" = loop.create_future()
+        self._waiters.append(waiter)
+        self._update_gauges()
+        timer = loop.call_later(self.wait, _expire, waiter)
+        start = time.perf_counter()
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            # The slot might have been handed over just before the request
+            # was cancelled
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            # The waiter is already off the queue if it was admitted
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            self._update_gauges()
+
+        ADMISSION_WAIT.observe(time.perf_counter() - start, (self.name,))
+        if not admitted:
+            return self._shed("timeout")
+        return True
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+
+def _expire(waiter: "asyncio.Future[bool]") -> None:
+    if not waiter.done():
+        waiter.set_result(False)
+
+
+class AdmissionControl:
+    """Limit the number of concurrent requests by priority class
+
+    Under a spike, every handler competes for the event loop and for the
+    Spotify rate limit, so the host's track changes end up waiting behind a
+    flood of listener syncs and page renders. Each route has a priority class
+    (see ``ROUTE_PRIORITIES``) and each class has its own limit on the number
+    of requests that are handled at once. The requests over the limit wait in
+    a bounded queue; when the queue is full or the wait is longer than the
+    class allows, the request is rejected right away with a ``503`` and a
+    ``Retry-After`` header instead of piling on.
+
+    The low priority class gets the shortest wait so that it's the first to
+    be shed.
+
+    Args:
+        limits (Mapping[str, int]): The concurrency limit for each class
+        waits (Mapping[str, float]): The longest time (in seconds) that a
+            request in each class can wait for a slot
+        queue_size (int): The number of requests that can wait in each class
+
+    """
+
+    def __init__(
+        self,
+        limits: Mapping[str, int],
+        waits: Mapping[str, float],
+        queue_size: int,
+    ):
+        self.classes: Dict[str, PriorityClass] = {
+            name: PriorityClass(name, limits[name], queue_size, waits[name])
+            for name in PRIORITIES
+        }
+
+    async def acquire(self, priority: str) -> bool:
+        return await self.classes[priority].acquire()
+
+    def release(self, priority: str) -> None:
+        self.classes[priority].release()
+
+
+@web.middleware
+async def admission_middleware(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    # This is installed on the top-level app only so that the pages and the
+    # API routes share the same limits
+    admission = request.config_dict["admission"]
+    if admission is None:
+        return await handler(request)
+
+    priority = priority_for(request.match_info.route.name)
+    if priority is None:
+        return await handler(request)
+
+    if not await admission.acquire(priority):
+        text = "The server is too busy, try again soon"
+        headers = {hdrs.RETRY_AFTER: str(RETRY_AFTER)}
+        # This runs outside of the sub-app's error handling so the API
+        # errors are formatted here
+        if request.match_info.apps[-1].get("json_errors", False):
+            return codec.json_response(
+                {"error": text}, status=503, headers=headers
+            )
+        raise web.HTTPServiceUnavailable(text=text, headers=headers)
+    try:
+        return await handler(request)
+    finally:
+        admission.release(priority)
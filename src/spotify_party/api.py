@@ -1,19 +1,28 @@
 __all__ = ["api_app"]
 
-import json
-import traceback
+import asyncio
+import logging
 from functools import partial, wraps
 from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
 
 import yarl
-from aiohttp import web
+from aiohttp import hdrs, web
 
+from . import codec
 from .auth import require_auth
-from .data_model import User
-from .socket import sio
+from .data_model import Room, User
+from .directory import etag_matches
+from .recorder import recording_middleware
+from .socket import emit
+from .tracing import tracing_middleware
+
+logger = logging.getLogger(__name__)
 
 routes = web.RouteTableDef()
 
+ROOMS_PAGE_SIZE = 50
+ROOMS_MAX_PAGE_SIZE = 500
+
 
 def endpoint(
     handler: Optional[
@@ -32,46 +41,70 @@ def endpoint(
     )
 
 
-def _endpoint(
-    handler: Callable[[web.Request, User, Mapping[str, Any]], Awaitable],
-    *,
-    required_data: Mapping[str, Callable] = {},
-    optional_data: Mapping[str, Callable] = {},
-) -> Callable[[web.Request], Awaitable]:
-    @require_auth(redirect=False)
-    @wraps(handler)
-    async def wrapped(request: web.Request, user: User) -> web.Response:
-        try:
-            original_data = await request.json()
-        except json.decoder.JSONDecodeError:
-            original_data = {}
-        data: Dict[str, Any] = dict()
+class FieldValidator:
+    """Validate and convert the fields of a request body
+
+    The field specification is compiled once per endpoint so that each
+    request only needs a single pass over the body.
+
+    """
+
+    __slots__ = ("required", "mappers")
+
+    def __init__(
+        self,
+        required_data: Mapping[str, Callable],
+        optional_data: Mapping[str, Callable],
+    ):
+        self.required = tuple(required_data.keys())
+        self.mappers = dict(optional_data)
+        self.mappers.update(required_data)
+
+    def __call__(self, body: Any) -> Dict[str, Any]:
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Invalid request body")
 
         # Make sure that the required data was included
-        for key, mapper in required_data.items():
-            if key not in original_data:
+        for key in self.required:
+            if key not in body:
                 raise web.HTTPBadRequest(
                     text=f"Missing required field: '{key}'"
                 )
-            try:
-                data[key] = mapper(original_data.pop(key))
-            except TypeError:
-                raise web.HTTPBadRequest(
-                    text=f"Invalid type for field: '{key}'"
-                )
 
-        # Map the rest of the data
-        for key, value in original_data.items():
-            if key not in optional_data:
+        # Map the data
+        mappers = self.mappers
+        data: Dict[str, Any] = dict()
+        for key, value in body.items():
+            mapper = mappers.get(key, None)
+            if mapper is None:
                 raise web.HTTPBadRequest(text=f"Invalid field: '{key}'")
             try:
-                data[key] = optional_data[key](value)
-            except TypeError:
+                data[key] = mapper(value)
+            except (TypeError, ValueError):
                 raise web.HTTPBadRequest(
                     text=f"Invalid type for field: '{key}'"
                 )
 
-        return await handler(request, user, data)
+        return data
+
+
+def _endpoint(
+    handler: Callable[[web.Request, User, Mapping[str, Any]], Awaitable],
+    *,
+    required_data: Mapping[str, Callable] = {},
+    optional_data: Mapping[str, Callable] = {},
+) -> Callable[[web.Request], Awaitable]:
+    validate = FieldValidator(required_data, optional_data)
+
+    @require_auth(redirect=False)
+    @wraps(handler)
+    async def wrapped(request: web.Request, user: User) -> web.Response:
+        body = await request.read()
+        try:
+            original_data = codec.loads(body) if body else {}
+        except ValueError:
+            original_data = {}
+        return await handler(request, user, validate(original_data))
 
     return wrapped
 
@@ -84,7 +117,7 @@ def _endpoint(
 @routes.route("*", "/me", name="interface.me")
 @require_auth
 async def me(request: web.Request, user: User) -> web.Response:
-    return web.json_response(
+    return codec.json_response(
         dict(user_id=user.user_id, display_name=user.display_name)
     )
 
@@ -92,7 +125,45 @@ async def me(request: web.Request, user: User) -> web.Response:
 @routes.post("/token", name="interface.token")
 @require_auth(redirect=False)
 async def token(request: web.Request, user: User) -> web.Response:
-    return web.json_response({"token": user.auth.access_token})
+    return codec.json_response({"token": user.auth.access_token})
+
+
+@routes.get("/rooms", name="interface.rooms")
+@require_auth(redirect=False)
+async def rooms(request: web.Request, user: User) -> web.Response:
+    after = request.query.get("after", None)
+    try:
+        limit = min(
+            int(request.query.get("limit", ROOMS_PAGE_SIZE)),
+            ROOMS_MAX_PAGE_SIZE,
+        )
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid limit")
+    if limit <= 0:
+        raise web.HTTPBadRequest(text="Invalid limit")
+
+    # This page is cached until the directory or the listener counts change
+    directory = request.config_dict["db"].directory
+    headers = {"ETag": directory.listeners_etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, directory.listeners_etag):
+        return web.Response(status=304, headers=headers)
+
+    async def get_page() -> Dict[str, Any]:
+        rows = await request.config_dict["db"].get_room_directory(
+            after=after, limit=limit
+        )
+        return {
+            "rooms": [
+                {"room_id": room_id, "host": host, "listeners": listeners}
+                for room_id, host, listeners in rows
+            ],
+            "next": rows[-1][0] if len(rows) == limit else None,
+        }
+
+    page = await directory.get(
+        ("rooms", after, limit), get_page, listeners=True
+    )
+    return codec.json_response(page, headers=headers)
 
 
 @routes.post("/transfer", name="interface.transfer")
@@ -102,9 +173,9 @@ async def transfer(
 ) -> web.Response:
     user.device_id = data["device_id"]
     if not await user.transfer(request, play=True, check=True):
-        return web.json_response({"error": "Unable to transfer"})
+        return codec.json_response({"error": "Unable to transfer"})
 
-    return web.json_response(
+    return codec.json_response(
         {"playing": await user.currently_playing(request)}
     )
 
@@ -121,11 +192,40 @@ async def stop(request: web.Request, user: User) -> web.Response:
 #
 
 
+async def _play_to_room(
+    request: web.Request, room: Room, playing: Mapping[str, Any]
+) -> None:
+    """Start playback for the listeners and then tell them what's playing"""
+    await room.play(
+        request,
+        playing["uri"],
+        playing.get("position_ms", None),
+        context_uri=playing.get("context_uri", None),
+        duration_ms=playing.get("duration_ms", None),
+    )
+    request.config_dict["scheduler"].schedule(request, room.room_id)
+    update = request.config_dict["room_updates"].update(
+        room.room_id, {"number": len(await room.listeners), "playing": playing}
+    )
+    await emit("changed", update, room=room.room_id)
+
+
+def _spawn(request: web.Request, name: str, coro: Awaitable) -> None:
+    """Continue the fan-out to the listeners after the host gets a response"""
+    request.config_dict["background_tasks"].spawn(name, coro)
+
+
 @routes.post("/broadcast/start", name="broadcast.start")
 @endpoint(required_data=dict(device_id=str, room_name=str))
 async def broadcast_start(
     request: web.Request, user: User, data: Mapping[str, Any]
 ) -> web.Response:
+    # New rooms would be lost in the snapshot once we're shutting down
+    if request.config_dict["restart"].draining:
+        raise web.HTTPServiceUnavailable(
+            text="The server is restarting", headers={"Retry-After": "5"}
+        )
+
     user.device_id = data["device_id"]
     room_name = data["room_name"]
 
@@ -137,6 +237,11 @@ async def broadcast_start(
     user.paused = False
     user.listening_to_id = None
     room_id = user.playing_to_id = f"{user.user_id}/{room_name}"
+    room = Room(user)
+
+    # Make sure that all of the listeners are sent the current track
+    request.config_dict["playback"].pop(room_id)
+    request.config_dict["room_updates"].pop(room_id)
 
     # Construct the stream URL
     url = yarl.URL(request.config_dict["config"]["base_url"]).with_path(
@@ -146,27 +251,19 @@ async def broadcast_start(
         "room_id": room_id,
         "stream_url": str(url),
         "playing": None,
-        "number": 0,
+        "number": len(await room.listeners),
     }
 
-    # Get the currently playing track
+    # Get the currently playing track and then start playback for the
+    # listeners in the background
     current = await user.currently_playing(request)
     if current is not None:
         response["playing"] = current
+        _spawn(
+            request, "broadcast.start", _play_to_room(request, room, current)
+        )
 
-        # Start playback for listeners
-        room = await user.playing_to
-        if room is not None:
-            await room.play(
-                request, current["uri"], current.get("position_ms", None)
-            )
-
-            response["number"] = len(await room.listeners)
-
-        # Update the info for the listeners
-        await sio.emit("changed", response, room=room_id)
-
-    return web.json_response(response)
+    return codec.json_response(response)
 
 
 @routes.post("/broadcast/stop", name="broadcast.stop")
@@ -176,30 +273,35 @@ async def broadcast_stop(
 ) -> web.Response:
     user.device_id = data["device_id"]
     user.paused = True
+    request.config_dict["playback"].pop(user.playing_to_id)
+    request.config_dict["room_updates"].pop(user.playing_to_id)
+    request.config_dict["scheduler"].cancel(user.playing_to_id)
     if not await user.pause(request):
         raise web.HTTPNotFound(text="Unable to pause playback")
-    return web.json_response({})
+    return codec.json_response({})
 
 
 @routes.post("/broadcast/pause", name="broadcast.pause")
 @require_auth(redirect=False)
 async def broadcast_pause(request: web.Request, user: User) -> web.Response:
     user.paused = True
+    request.config_dict["playback"].pop(user.playing_to_id)
+    request.config_dict["scheduler"].cancel(user.playing_to_id)
 
     # Here we're pausing the playback of the listeners
     # We're not going to bother checking for success because the host doesn't
     # care too much if we can't pause all the user playback.
     room = await user.playing_to
     if room:
-        await room.pause(request)
+        _spawn(request, "broadcast.pause", room.pause(request))
 
-    return web.json_response({})
+    return codec.json_response({})
 
 
 @routes.post("/broadcast/change", name="broadcast.change")
 @endpoint(
     required_data=dict(uri=str, name=str, type=str, id=str),
-    optional_data=dict(position_ms=int),
+    optional_data=dict(position_ms=int, duration_ms=int, context_uri=str),
 )
 async def broadcast_change(
     request: web.Request, user: User, data: Mapping[str, Any]
@@ -210,14 +312,9 @@ async def broadcast_change(
         raise web.HTTPUnauthorized(text="This user is not currently playing")
 
     user.paused = False
-    await room.play(request, data["uri"], data.get("position_ms", None))
-    await sio.emit(
-        "changed",
-        {"number": len(await room.listeners), "playing": data},
-        room=room.room_id,
-    )
+    _spawn(request, "broadcast.change", _play_to_room(request, room, data))
 
-    return web.json_response({})
+    return codec.json_response({})
 
 
 #
@@ -252,7 +349,7 @@ async def listen_start(
     response["number"] += 1
 
     # It worked!
-    return web.json_response(response)
+    return codec.json_response(response)
 
 
 @routes.post("/listen/stop", name="listen.stop")
@@ -264,7 +361,7 @@ async def listen_stop(
     user.paused = True
     if not await user.pause(request):
         raise web.HTTPNotFound(text="Unable to pause playback")
-    return web.json_response({})
+    return codec.json_response({})
 
 
 @routes.post("/listen/sync", name="listen.sync")
@@ -278,7 +375,7 @@ async def listen_sync(
     if response is None:
         raise web.HTTPNotFound(text="The broadcast is paused")
 
-    return web.json_response(response)
+    return codec.json_response(response)
 
 
 #
@@ -293,15 +390,42 @@ async def error_middleware(
     try:
         return await handler(request)
     except web.HTTPException as ex:
-        return web.json_response({"error": ex.text}, status=ex.status)
+        headers = {
+            name: value
+            for name, value in ex.headers.items()
+            if name != hdrs.CONTENT_TYPE
+        }
+        return codec.json_response(
+            {"error": ex.text}, status=ex.status, headers=headers
+        )
+    except asyncio.TimeoutError:
+        logger.warning(
+            "timeout in %s",
+            request.match_info.route.name,
+            extra={"method": request.method, "path": request.path},
+        )
+        return codec.json_response(
+            {"error": "Spotify took too long to respond"}, status=504
+        )
     except Exception:
-        traceback.print_exc()
-        return web.json_response(
+        logger.exception(
+            "unhandled error in %s",
+            request.match_info.route.name,
+            extra={"method": request.method, "path": request.path},
+        )
+        return codec.json_response(
             {"error": "Something went horribly wrong"}, status=500
         )
 
 
 def api_app() -> web.Application:
-    app = web.Application(middlewares=[error_middleware])
+    app = web.Application(
+        middlewares=[
+            tracing_middleware,
+            recording_middleware,
+            error_middleware,
+        ]
+    )
+    app["json_errors"] = True
     app.add_routes(routes)
     return app
@@ -1,47 +1,294 @@
 __all__ = ["app_factory"]
 
+import asyncio
 import base64
+import importlib.resources
 import pathlib
 from typing import Any, AsyncIterator, Mapping
 
-import aiohttp_jinja2
 import aiohttp_session
 import aiohttp_spotify
-import jinja2
-import pkg_resources
-from aiohttp import ClientSession, web
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from aiohttp import web
 
 from . import api, auth, db, jinja2_helpers, views
+from .admission import AdmissionControl, admission_middleware
+from .assets import StaticAssets
+from .background import BackgroundTasks
+from .breaker import CircuitBreakers
+from .commands import CommandQueue
+from .devices import DeviceWatcher
+from .logs import LogPipeline
+from .maintenance import Maintenance
+from .metrics import metrics_middleware
+from .monitor import LoopMonitor
+from .playback import PlaybackStates
+from .pools import create_session
+from .presence import Presence, PresenceSweeper
+from .recorder import Recorder
+from .rendering import StaticPages, setup_templates
+from .restart import WarmRestart
+from .scheduler import TransitionScheduler
+from .sessions import CachedEncryptedCookieStorage
+from .socket import configure as configure_socket
+from .socket import sio
+from .tracing import Tracer, tracing_middleware
+from .updates import RoomUpdates
 
 
 def get_resource_path(path: str) -> pathlib.Path:
     return pathlib.Path(
-        pkg_resources.resource_filename(__name__, path)
+        str(importlib.resources.files(__package__).joinpath(path))
     ).resolve()
 
 
 async def client_session(app: web.Application) -> AsyncIterator[None]:
-    """A fixture to create a single ClientSession for the app to use"""
-    async with ClientSession() as session:
-        app["client_session"] = session
+    """A fixture to create the ClientSessions for the app to use
+
+    The API requests (including the listener fan-out) and the token
+    refreshes get separate connection pools so that a burst of one can't
+    starve the other.
+
+    """
+    config = app["config"]
+    options = dict(
+        keepalive_timeout=config["spotify_keepalive_timeout"],
+        dns_cache_ttl=config["spotify_dns_cache_ttl"],
+        connect_timeout=config["spotify_connect_timeout"],
+        timeout=config["spotify_request_timeout"],
+    )
+    async with create_session(
+        "api", limit=config["spotify_api_pool_size"], **options
+    ) as api_session, create_session(
+        "accounts", limit=config["spotify_accounts_pool_size"], **options
+    ) as accounts_session:
+        app["client_session"] = api_session
+        app["accounts_session"] = accounts_session
         yield
 
 
+async def warm_restart(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to restore and save the room state across restarts
+
+    This is torn down after the background tasks and the scheduler so that
+    the snapshot includes all of their writes.
+
+    """
+    config = app["config"]
+    app["restart"] = restart = WarmRestart(
+        config["snapshot_file"] or None, window=config["resume_window"]
+    )
+    restart.load(app)
+    task = asyncio.ensure_future(restart.expire(app))
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    restart.save(app)
+
+
+async def start_draining(app: web.Application) -> None:
+    """Stop accepting new broadcasts before the connections are closed"""
+    app["restart"].start_draining()
+
+
+async def presence_sweeper(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to periodically pause the users that aren't connected"""
+    interval = app["config"]["presence_sweep_interval"]
+    app["presence_sweeper"] = sweeper = PresenceSweeper(interval)
+    if interval <= 0:
+        yield
+        return
+    task = asyncio.ensure_future(sweeper.run(app))
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def maintenance(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to periodically prune and compact the database"""
+    config = app["config"]
+    app["maintenance"] = job = Maintenance(
+        config["maintenance_interval"],
+        retention_days=config["retention_days"],
+        room_retention_days=config["room_retention_days"],
+        batch_size=config["maintenance_batch_size"],
+    )
+    if job.interval <= 0:
+        yield
+        return
+    task = asyncio.ensure_future(job.run(app))
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def command_queue(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to run the workers that send the listener commands"""
+    app["commands"] = commands = CommandQueue(
+        workers=app["config"]["command_workers"]
+    )
+    commands.start()
+    yield
+    await commands.close()
+
+
+async def background_tasks(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to track the tasks that outlive their requests"""
+    app["background_tasks"] = tasks = BackgroundTasks()
+    yield
+    await tasks.close(timeout=10.0)
+
+
+async def tracer(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to set up the request tracing"""
+    config = app["config"]
+    app["tracer"] = tracer = Tracer(
+        enabled=config["tracing"],
+        slow_request_ms=config["slow_request_ms"],
+        trace_file=config["trace_file"] or None,
+    )
+    yield
+    tracer.close()
+
+
+async def log_pipeline(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to write the logs from a background thread"""
+    config = app["config"]
+    pipeline = LogPipeline(
+        level=config["log_level"],
+        json=config["log_json"],
+        rate=config["log_rate"],
+        burst=config["log_burst"],
+        sample=config["log_sample"],
+        queue_size=config["log_queue_size"],
+    )
+    pipeline.start()
+    yield
+    pipeline.stop()
+
+
+async def loop_monitor(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to measure the event loop lag and catch blocking calls"""
+    config = app["config"]
+    app["loop_monitor"] = monitor = LoopMonitor(
+        config["loop_monitor_interval"],
+        stall_threshold=1e-3 * config["loop_stall_ms"],
+    )
+    if monitor.interval <= 0:
+        yield
+        return
+    monitor.start()
+    yield
+    await monitor.close()
+
+
+async def recorder(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to record the API traffic (if a file is configured)"""
+    filename = app["config"]["record_file"]
+    app["recorder"] = recorder = Recorder(filename) if filename else None
+    yield
+    if recorder is not None:
+        recorder.close()
+
+
+async def transition_scheduler(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to cancel the scheduled track transitions on shutdown"""
+    app["scheduler"] = scheduler = TransitionScheduler()
+    yield
+    await scheduler.close()
+
+
+async def prepare_static_pages(app: web.Application) -> None:
+    """Render the static pages once all of the routes are known"""
+    app["static_pages"].prepare()
+
+
 def app_factory(config: Mapping[str, Any]) -> web.Application:
     app = web.Application(
-        middlewares=[views.error_middleware, web.normalize_path_middleware()]
+        middlewares=[
+            metrics_middleware,
+            tracing_middleware,
+            views.error_middleware,
+            admission_middleware,
+            web.normalize_path_middleware(),
+        ]
     )
 
     # load the configuration file
     app["config"] = config
 
+    # Limit the concurrent requests by priority and shed the excess (this is
+    # opt-in because the limits depend on the deployment)
+    app["admission"] = None
+    if config["admission_control"]:
+        app["admission"] = AdmissionControl(
+            limits={
+                "critical": config["admission_critical_limit"],
+                "normal": config["admission_normal_limit"],
+                "low": config["admission_low_limit"],
+            },
+            waits={
+                "critical": config["admission_critical_wait"],
+                "normal": config["admission_normal_wait"],
+                "low": config["admission_low_wait"],
+            },
+            queue_size=config["admission_queue_size"],
+        )
+
+    # Write the logs off the event loop (this is closed last so that it
+    # gets the logs from the other fixtures)
+    app.cleanup_ctx.append(log_pipeline)
+
+    # Set up the request tracing
+    app.cleanup_ctx.append(tracer)
+
+    # Watch the event loop for blocking work (a zero interval disables this)
+    app.cleanup_ctx.append(loop_monitor)
+
+    # Record the API traffic for replaying later (if enabled)
+    app.cleanup_ctx.append(recorder)
+
     # Add the client session for pooling outgoing connections
     app.cleanup_ctx.append(client_session)
 
+    # Carry the room state over to the next process on restarts
+    app.cleanup_ctx.append(warm_restart)
+    app.on_shutdown.append(start_draining)
+
+    # Fix up the users whose disconnects were missed (a zero interval
+    # disables this)
+    app.cleanup_ctx.append(presence_sweeper)
+
+    # Prune the inactive users and compact the database (a zero interval
+    # disables this)
+    app.cleanup_ctx.append(maintenance)
+
+    # Send the listener commands through a queue (this must be closed after
+    # the background tasks that submit the commands)
+    app.cleanup_ctx.append(command_queue)
+
+    # Keep track of the background tasks (these must be closed before the
+    # client session)
+    app.cleanup_ctx.append(background_tasks)
+    app.cleanup_ctx.append(transition_scheduler)
+
     # Connect the database and set up a map of websockets
     app["db"] = db.Database(config["database_filename"])
 
+    # Keep track of which Spotify devices are active
+    app["devices"] = DeviceWatcher()
+
+    # Keep track of the connected sockets
+    app["presence"] = Presence()
+
+    # Skip listener devices that keep failing
+    app["breakers"] = CircuitBreakers()
+
+    # The current playback for each room
+    app["playback"] = PlaybackStates()
+
+    # The last state that each room was sent
+    app["room_updates"] = RoomUpdates()
+
     # And the routes for the main app
     app.add_routes(views.routes)
 
@@ -51,18 +298,32 @@ def app_factory(config: Mapping[str, Any]) -> web.Application:
     # Set up the user session for cookies
     aiohttp_session.setup(
         app,
-        EncryptedCookieStorage(
-            base64.urlsafe_b64decode(app["config"]["session_key"])
+        CachedEncryptedCookieStorage(
+            base64.urlsafe_b64decode(app["config"]["session_key"]),
+            cache_size=config["session_cache_size"],
+            cache_ttl=config["session_cache_ttl"],
         ),
     )
 
     # Set up the templating engine and the static endpoint
-    env = aiohttp_jinja2.setup(
-        app, loader=jinja2.FileSystemLoader(get_resource_path("templates"))
+    env = setup_templates(
+        app,
+        get_resource_path("templates"),
+        debug=config["debug_templates"],
+        compiled_dir=config["compiled_templates"] or None,
     )
     env.globals.update(jinja2_helpers.GLOBALS)
+    app["static_pages"] = StaticPages(
+        env, views.STATIC_PAGES, debug=config["debug_templates"]
+    )
+    app.on_startup.append(prepare_static_pages)
+    app["assets"] = StaticAssets(
+        get_resource_path("assets"), debug=config["debug_templates"]
+    )
     app["static_root_url"] = "/assets"
-    app.router.add_static("/assets", get_resource_path("assets"))
+    app.router.add_get(
+        "/assets/{filename:.+}", app["assets"].handle, name="assets"
+    )
 
     # Set up the Spotify app to instigate the OAuth flow
     app["spotify_app"] = aiohttp_spotify.spotify_app(
@@ -84,6 +345,7 @@ def app_factory(config: Mapping[str, Any]) -> web.Application:
     app.add_subapp("/spotify", app["spotify_app"])
 
     # Attach the socket.io interface
-    api.sio.attach(app)
+    configure_socket(config)
+    sio.attach(app)
 
     return app
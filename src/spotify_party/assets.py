@@ -0,0 +1,131 @@
+__all__ = ["StaticAssets"]
+
+import json
+import mimetypes
+import os
+import pathlib
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from aiohttp import web
+
+from .rendering import accepts_encoding
+
+# The encodings that webpack pre-compresses the assets with, in order of
+# preference, along with their file suffixes
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Asset(NamedTuple):
+    path: pathlib.Path
+    content_type: str
+    variants: List[Tuple[str, pathlib.Path]]
+    hashed: bool
+
+
+class StaticAssets:
+    """Serve the webpack build from the assets directory
+
+    The build writes a ``manifest.json`` mapping each entry point (e.g.
+    ``bundle.js``) to its content-hashed filename, and pre-compresses the
+    larger files with gzip and brotli. The ``static`` template helper uses
+    the manifest to link to the hashed files, which never change so they are
+    served with an immutable cache header. Everything else must be
+    revalidated. The files are sent using ``sendfile`` where possible.
+
+    Args:
+        directory (pathlib.Path): The assets directory
+        debug (bool, optional): Reload the manifest whenever it changes (for
+            use with ``npm run watch``)
+
+    """
+
+    def __init__(self, directory: pathlib.Path, *, debug: bool = False):
+        self.directory = directory.resolve()
+        self.debug = debug
+        self._manifest: Dict[str, str] = {}
+        self._manifest_mtime: Optional[float] = None
+        self._assets: Dict[str, Asset] = {}
+        self._load_manifest()
+
+    def _load_manifest(self) -> None:
+        path = self.directory / "manifest.json"
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            self._manifest = {}
+            self._manifest_mtime = None
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(path, "r") as f:
+            self._manifest = json.load(f)
+        self._manifest_mtime = mtime
+        self._assets = {}
+
+    @property
+    def manifest(self) -> Dict[str, str]:
+        if self.debug:
+            self._load_manifest()
+        return self._manifest
+
+    def resolve(self, name: str) -> str:
+        """Get the filename for an asset, including its content hash"""
+        return self.manifest.get(name, name)
+
+    def _is_hashed(self, filename: str) -> bool:
+        # Files that are copied as-is (like the icons) map to themselves
+        return any(
+            filename == value and name != value
+            for name, value in self.manifest.items()
+        )
+
+    def _find(self, filename: str) -> Optional[Asset]:
+        if filename in self._assets:
+            return self._assets[filename]
+
+        path = (self.directory / filename).resolve()
+        asset = None
+        if path.is_file() and self.directory in path.parents:
+            content_type, _ = mimetypes.guess_type(path.name)
+            asset = Asset(
+                path=path,
+                content_type=content_type or "application/octet-stream",
+                variants=[
+                    (encoding, path.with_name(path.name + suffix))
+                    for encoding, suffix in ENCODINGS
+                    if path.with_name(path.name + suffix).is_file()
+                ],
+                hashed=self._is_hashed(filename),
+            )
+
+        # Only the files that exist are cached so that requests for random
+        # paths can't grow the cache. The files change on every rebuild in
+        # debug mode so nothing is cached then.
+        if asset is not None and not self.debug:
+            self._assets[filename] = asset
+        return asset
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        filename = request.match_info["filename"]
+        if os.path.splitext(filename)[1] in (".br", ".gz"):
+            raise web.HTTPNotFound()
+        asset = self._find(filename)
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        headers = {
+            "Content-Type": asset.content_type,
+            "Cache-Control": IMMUTABLE if asset.hashed else "no-cache",
+        }
+        path: Union[str, pathlib.Path] = asset.path
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+        for encoding, variant in asset.variants:
+            if accepts_encoding(request, encoding):
+                headers["Content-Encoding"] = encoding
+                path = variant
+                break
+
+        return web.FileResponse(path, headers=headers)
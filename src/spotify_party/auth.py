@@ -5,9 +5,12 @@ from functools import partial, wraps
 from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Tuple
 
 import aiohttp_session
-from aiohttp import web
+from aiohttp import ClientResponseError, web
 from aiohttp_spotify import SpotifyAuth, SpotifyResponse
 
+from .metrics import SPOTIFY_LATENCY
+from .tracing import span
+
 if TYPE_CHECKING:
     from .data_model import User  # NOQA
 
@@ -42,7 +45,8 @@ def _require_auth(
 
     @wraps(handler)
     async def wrapped(request: web.Request) -> web.Response:
-        session = await aiohttp_session.get_session(request)
+        with span("session"):
+            session = await aiohttp_session.get_session(request)
         user_id = session.get("sp_user_id")
         user = await request.config_dict["db"].get_user(user_id)
         if user is None:
@@ -60,8 +64,12 @@ def _require_auth(
         if admin and user.user_id not in request.app["config"]["admins"]:
             return web.HTTPNotFound()
 
+        # Keep track of the user for the request recorder
+        request["user"] = user
+
         async with user:
-            await user.update_auth(request)
+            with span("update_auth"):
+                await user.update_auth(request)
             return await handler(request, user)
 
     return wrapped
@@ -98,7 +106,7 @@ async def update_auth(
         auth_changed = True
         auth = await request.config_dict["spotify_app"][
             "spotify_client"
-        ].update_auth(request.config_dict["client_session"], auth)
+        ].update_auth(request.config_dict["accounts_session"], auth)
     return auth_changed, auth
 
 
@@ -126,18 +134,43 @@ async def call_api(
     if user is None:
         return None
 
-    response = await request.config_dict["spotify_app"][
-        "spotify_client"
-    ].request(
-        request.config_dict["client_session"],
-        user.auth,
-        endpoint,
-        method=method,
-        **kwargs,
-    )
+    # Refresh the token through the accounts pool here; aiohttp_spotify
+    # would otherwise refresh it through the API pool
+    await user.update_auth(request)
+
+    start = time.perf_counter()
+    status = "error"
+    try:
+        with span(f"spotify {method} {endpoint}"):
+            response = await request.config_dict["spotify_app"][
+                "spotify_client"
+            ].request(
+                request.config_dict["client_session"],
+                user.auth,
+                endpoint,
+                method=method,
+                **kwargs,
+            )
+        status = str(response.status)
+    except ClientResponseError as e:
+        status = str(e.status)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        SPOTIFY_LATENCY.observe(duration, (endpoint, method, status))
+        recorder = request.config_dict["recorder"]
+        if recorder is not None:
+            recorder.spotify(
+                user.user_id,
+                endpoint,
+                method,
+                start=time.time() - duration,
+                duration=duration,
+                status=status,
+            )
 
     # Update the authentication info if required
     if response.auth_changed:
-        user.auth = response.auth
+        await user.set_auth(response.auth)
 
     return response
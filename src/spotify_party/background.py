@@ -0,0 +1,104 @@
+__all__ = ["BackgroundTasks"]
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStats:
+    """Completion metrics for one kind of background task"""
+
+    __slots__ = (
+        "started",
+        "completed",
+        "failed",
+        "cancelled",
+        "total_time",
+        "max_time",
+    )
+
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def running(self) -> int:
+        return self.started - self.completed - self.failed - self.cancelled
+
+    @property
+    def mean_time(self) -> float:
+        finished = self.started - self.running
+        if finished <= 0:
+            return 0.0
+        return self.total_time / finished
+
+
+class BackgroundTasks:
+    """Keep track of work that continues after a response has been sent
+
+    Handlers use :func:`spawn` to hand off work (like the fan-out to the
+    listeners in a room) that the client doesn't need to wait for. The tasks
+    are tracked so that they can be awaited when the app shuts down and so
+    that their completion metrics can be reported.
+
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats: Dict[str, TaskStats] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def spawn(self, name: str, coro: Awaitable) -> asyncio.Task:
+        """Run a coroutine in the background
+
+        Args:
+            name (str): The name used to group the metrics for this task
+            coro (Awaitable): The coroutine to run
+
+        """
+        task = asyncio.ensure_future(self._run(name, coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, name: str, coro: Awaitable) -> None:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = TaskStats()
+        stats.started += 1
+        start = time.monotonic()
+        try:
+            await coro
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.failed += 1
+            logger.exception(
+                "background task %s failed", name, extra={"task": name}
+            )
+        else:
+            stats.completed += 1
+        finally:
+            delta = time.monotonic() - start
+            stats.total_time += delta
+            stats.max_time = max(stats.max_time, delta)
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Wait for the pending tasks and cancel any that don't finish"""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
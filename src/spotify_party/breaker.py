@@ -0,0 +1,134 @@
+__all__ = ["CircuitBreakers"]
+
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .data_model import User  # NOQA
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# The number of devices with recent failures to keep track of
+MAX_BREAKERS = 4096
+
+# A listener's user id and device id
+_Key = Tuple[str, Optional[str]]
+
+
+class CircuitBreaker:
+    __slots__ = ("state", "failures", "cooldown", "changed_at", "failed_at")
+
+    def __init__(self, cooldown: float):
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.changed_at = self.failed_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """Circuit breakers for the listener devices in a room fan-out
+
+    A listener who closed their tab without a clean disconnect leaves a stale
+    device behind and every command sent to it fails slowly. After
+    ``threshold`` consecutive failures, the breaker for that user and device
+    opens and the device is skipped for ``cooldown`` seconds. After that, a
+    single probe is let through (half-open): if it succeeds the breaker
+    closes, otherwise it opens again with twice the cool-down (up to
+    ``max_cooldown``).
+
+    Only the breakers that have recorded failures are stored, and they are
+    forgotten once they haven't recorded a failure for ``max_cooldown``
+    seconds (by then, even the longest cool-down has passed) or when there
+    are more than ``MAX_BREAKERS`` of them, oldest failure first.
+
+    Args:
+        threshold (int, optional): The number of consecutive failures needed
+            to open the breaker
+        cooldown (float, optional): The initial cool-down in seconds
+        max_cooldown (float, optional): The maximum cool-down in seconds
+
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: int = 3,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # Ordered by the time of the last failure
+        self._breakers: "OrderedDict[_Key, CircuitBreaker]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._breakers)
+
+    def _key(self, user: "User") -> _Key:
+        return (user.user_id, user.device_id)
+
+    def state(self, user: "User") -> str:
+        breaker = self._breakers.get(self._key(user), None)
+        if breaker is None:
+            return CLOSED
+        return breaker.state
+
+    def failures(self, user: "User") -> int:
+        breaker = self._breakers.get(self._key(user), None)
+        if breaker is None:
+            return 0
+        return breaker.failures
+
+    def allow(self, user: "User") -> bool:
+        """Should a command be sent to this user's device?"""
+        breaker = self._breakers.get(self._key(user), None)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+
+        # Let a probe through once the cool-down has passed. If a probe never
+        # reported back, another one is allowed after the next cool-down.
+        now = time.monotonic()
+        if now - breaker.changed_at >= breaker.cooldown:
+            breaker.state = HALF_OPEN
+            breaker.changed_at = now
+            return True
+
+        return False
+
+    def record(self, user: "User", success: bool) -> None:
+        key = self._key(user)
+        if success:
+            self._breakers.pop(key, None)
+            return
+
+        now = time.monotonic()
+        breaker = self._breakers.get(key, None)
+        if breaker is None:
+            self._prune(now)
+            breaker = self._breakers[key] = CircuitBreaker(self.cooldown)
+        else:
+            self._breakers.move_to_end(key)
+        breaker.failures += 1
+        breaker.failed_at = now
+
+        if breaker.state == HALF_OPEN:
+            breaker.state = OPEN
+            breaker.cooldown = min(2 * breaker.cooldown, self.max_cooldown)
+            breaker.changed_at = time.monotonic()
+        elif breaker.state == CLOSED and breaker.failures >= self.threshold:
+            breaker.state = OPEN
+            breaker.changed_at = time.monotonic()
+
+    def _prune(self, now: float) -> None:
+        while self._breakers:
+            breaker = next(iter(self._breakers.values()))
+            if (
+                now - breaker.failed_at <= self.max_cooldown
+                and len(self._breakers) < MAX_BREAKERS
+            ):
+                break
+            self._breakers.popitem(last=False)
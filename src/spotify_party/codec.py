@@ -0,0 +1,94 @@
+__all__ = [
+    "NAME",
+    "dumps",
+    "dumps_bytes",
+    "loads",
+    "json_response",
+    "SocketIOJSON",
+]
+
+import json
+from typing import Any, Callable, Mapping, Optional, Tuple, Union
+
+from aiohttp import web
+
+Dumps = Callable[[Any], bytes]
+Loads = Callable[[Union[str, bytes]], Any]
+
+
+def _orjson_default(obj: Any) -> Any:
+    # orjson doesn't serialize tuple subclasses (like the sqlite rows)
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _select() -> Tuple[str, Dumps, Loads]:
+    """Pick the fastest JSON library that is installed"""
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        return (
+            "orjson",
+            lambda obj: orjson.dumps(obj, default=_orjson_default),
+            orjson.loads,
+        )
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        return (
+            "ujson",
+            lambda obj: ujson.dumps(obj, ensure_ascii=False).encode("utf-8"),
+            ujson.loads,
+        )
+
+    return (
+        "json",
+        lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"),
+        json.loads,
+    )
+
+
+NAME, dumps_bytes, loads = _select()
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def json_response(
+    data: Any,
+    *,
+    status: int = 200,
+    headers: Optional[Mapping[str, str]] = None,
+) -> web.Response:
+    """A drop-in replacement for ``web.json_response`` using the codec"""
+    return web.Response(
+        body=dumps_bytes(data),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+        charset="utf-8",
+    )
+
+
+class SocketIOJSON:
+    """The interface expected by the ``json`` option of ``AsyncServer``
+
+    python-socketio and python-engineio pass stdlib keyword arguments (like
+    ``separators``) which are ignored since the output is always compact.
+
+    """
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs) -> str:
+        return dumps(obj)
+
+    @staticmethod
+    def loads(s: Union[str, bytes], **kwargs) -> Any:
+        return loads(s)
@@ -0,0 +1,115 @@
+__all__ = ["CommandQueue"]
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Set
+
+from .metrics import COMMANDS_SUPERSEDED
+
+Command = Callable[[], Awaitable[bool]]
+
+
+class Pending(NamedTuple):
+    name: str
+    command: Command
+    future: "asyncio.Future[bool]"
+
+
+class CommandQueue:
+    """Send the player commands for each listener in order
+
+    When a host skips through several tracks quickly, each change starts a
+    fan-out to the listeners and the requests from these could overlap and
+    arrive at Spotify out of order. Instead, each listener has a single slot
+    for their next command: the commands for a user are sent one at a time,
+    and a new command replaces the one waiting in the slot (if it hasn't been
+    sent yet) since only the latest play or pause matters. The superseded
+    command resolves to ``False`` without being sent.
+
+    The commands are sent by a fixed number of workers so that a large room
+    can't open an unbounded number of requests at once.
+
+    Args:
+        workers (int, optional): The number of commands to send concurrently
+
+    """
+
+    def __init__(self, workers: int = 32):
+        self.workers = workers
+        self._pending: Dict[str, Pending] = {}
+        self._busy: Set[str] = set()
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+
+    async def close(self) -> None:
+        """Send the remaining commands and then stop the workers"""
+        await self._ready.join()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(
+        self, user_id: str, name: str, command: Command
+    ) -> "asyncio.Future[bool]":
+        """Queue the next command for a user
+
+        Args:
+            user_id (str): The user that the command is for
+            name (str): The kind of command (used to label the metrics)
+            command (Command): A function to send the command
+
+        Returns:
+            A future with the result of the command or ``False`` if it was
+            superseded by a newer one
+
+        """
+        future = asyncio.get_event_loop().create_future()
+        previous = self._pending.get(user_id)
+        self._pending[user_id] = Pending(name, command, future)
+        if previous is not None:
+            COMMANDS_SUPERSEDED.inc((previous.name,))
+            if not previous.future.done():
+                previous.future.set_result(False)
+
+        # If there was already a command waiting or one being sent, the user
+        # is already (or will be) on the ready queue
+        elif user_id not in self._busy:
+            self._ready.put_nowait(user_id)
+        return future
+
+    async def _work(self) -> None:
+        while True:
+            user_id = await self._ready.get()
+            try:
+                await self._send(user_id)
+            finally:
+                self._ready.task_done()
+
+    async def _send(self, user_id: str) -> None:
+        pending = self._pending.pop(user_id, None)
+        if pending is None or pending.future.done():
+            return
+        self._busy.add(user_id)
+        try:
+            result = await pending.command()
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as exc:
+            if not pending.future.done():
+                pending.future.set_exception(exc)
+        else:
+            if not pending.future.done():
+                pending.future.set_result(result)
+        finally:
+            self._busy.discard(user_id)
+            if user_id in self._pending:
+                self._ready.put_nowait(user_id)
@@ -3,7 +3,13 @@ __all__ = ["get_config"]
 from typing import Any, Mapping, MutableMapping
 
 import toml
-from cryptography import fernet
+
+
+def generate_session_key() -> str:
+    from cryptography import fernet
+
+    return fernet.Fernet.generate_key().decode("utf-8")
+
 
 schema: Mapping[str, Any] = dict(
     spotify_client_id=(str, None),
@@ -13,7 +19,54 @@ schema: Mapping[str, Any] = dict(
     database_filename=(str, None),
     port=(int, 5000),
     admins=(list, []),
-    session_key=(str, fernet.Fernet.generate_key().decode("utf-8")),
+    follow_context=(bool, False),
+    schedule_transitions=(bool, False),
+    tracing=(bool, False),
+    slow_request_ms=(int, 500),
+    trace_file=(str, ""),
+    record_file=(str, ""),
+    metrics_token=(str, ""),
+    debug_templates=(bool, False),
+    compiled_templates=(str, ""),
+    session_cache_size=(int, 4096),
+    session_cache_ttl=(float, 300.0),
+    spotify_api_pool_size=(int, 100),
+    spotify_accounts_pool_size=(int, 10),
+    spotify_keepalive_timeout=(float, 30.0),
+    spotify_dns_cache_ttl=(int, 300),
+    spotify_connect_timeout=(float, 5.0),
+    spotify_request_timeout=(float, 15.0),
+    snapshot_file=(str, ""),
+    resume_window=(float, 60.0),
+    command_workers=(int, 32),
+    presence_sweep_interval=(float, 0.0),
+    maintenance_interval=(float, 0.0),
+    retention_days=(float, 180.0),
+    room_retention_days=(float, 1.0),
+    maintenance_batch_size=(int, 200),
+    socket_compression_threshold=(int, 256),
+    socket_allow_polling=(bool, True),
+    socket_ping_interval=(float, 25.0),
+    socket_ping_timeout=(float, 20.0),
+    socket_max_queue=(int, 16),
+    admission_control=(bool, False),
+    admission_critical_limit=(int, 64),
+    admission_normal_limit=(int, 32),
+    admission_low_limit=(int, 16),
+    admission_critical_wait=(float, 5.0),
+    admission_normal_wait=(float, 1.0),
+    admission_low_wait=(float, 0.1),
+    admission_queue_size=(int, 64),
+    loop_monitor_interval=(float, 0.1),
+    loop_stall_ms=(int, 250),
+    log_level=(str, "INFO"),
+    log_json=(bool, False),
+    log_rate=(float, 10.0),
+    log_burst=(int, 50),
+    log_sample=(int, 100),
+    log_queue_size=(int, 10000),
+    # Callable defaults are only evaluated when the value isn't given
+    session_key=(str, generate_session_key),
 )
 
 
@@ -25,6 +78,8 @@ def validate_config(config: MutableMapping[str, Any]) -> Mapping[str, Any]:
     new_config = dict()
     for name, (converter, default) in schema.items():
         value = config.pop(name, default)
+        if callable(value) and value is default:
+            value = value()
         if value is None:
             raise ValidationError(f"missing value for '{name}'")
         try:
@@ -1,30 +1,41 @@
 __all__ = ["User", "Room"]
 
 import asyncio
+import logging
+import time
+from functools import partial
 from typing import (
     TYPE_CHECKING,
     Any,
+    Awaitable,
+    Callable,
     Dict,
     Iterable,
     List,
     Mapping,
-    MutableMapping,
     NamedTuple,
     Optional,
+    Tuple,
     Union,
 )
 
-from aiohttp import ClientResponseError, web
+from aiohttp import ClientError, ClientResponseError, web
 from aiohttp_spotify import SpotifyAuth
 
 from .auth import call_api, update_auth
-from .socket import sio
+from .playback import Playback, is_followable, next_in_context, play_payload
+from .socket import emit
 
 if TYPE_CHECKING:
     from . import db
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_RETRIES = 3
 
+# The longest album or playlist (in tracks) that listeners can follow
+MAX_CONTEXT_TRACKS = 1000
+
 
 class UserData(NamedTuple):
     user_id: str
@@ -73,23 +84,29 @@ class User:
         if old_data is None or new_data is None:
             raise ValueError("User updated outside a context")
 
+        rooms_changed = False
+        listeners_changed = False
+
         # The broadcast room changed
         if new_data.playing_to_id != old_data.playing_to_id:
+            rooms_changed = True
             if old_data.playing_to_id is not None:
-                await sio.emit("pause", room=old_data.playing_to_id)
+                await emit("pause", room=old_data.playing_to_id)
 
         # The room is the same, but the playing state changed
         elif (
             old_data.paused != new_data.paused
             and new_data.playing_to_id is not None
         ):
+            rooms_changed = True
             if new_data.paused:
-                await sio.emit("pause", room=new_data.playing_to_id)
+                await emit("pause", room=new_data.playing_to_id)
             else:
-                await sio.emit("unpause", room=new_data.playing_to_id)
+                await emit("unpause", room=new_data.playing_to_id)
 
         # The user was previously listening
         if new_data.listening_to_id != old_data.listening_to_id:
+            listeners_changed = True
             await self._send_listeners_to_room(old_data.listening_to_id, -1)
             await self._send_listeners_to_room(new_data.listening_to_id, 1)
 
@@ -97,6 +114,7 @@ class User:
             old_data.paused != new_data.paused
             and new_data.listening_to_id is not None
         ):
+            listeners_changed = True
             if new_data.paused:
                 await self._send_listeners_to_room(
                     new_data.listening_to_id, -1
@@ -107,6 +125,12 @@ class User:
         if self.data != self._context_data:
             await self.update()
 
+        # Invalidate the room directory once the database is up to date
+        if rooms_changed:
+            self.database.directory.rooms_changed()
+        elif listeners_changed:
+            self.database.directory.listeners_changed()
+
         self._context_data = None
 
     async def _send_listeners_to_room(
@@ -115,7 +139,7 @@ class User:
         if room_id is None:
             return
         listeners = await self.database.get_listeners(room_id)
-        await sio.emit(
+        await emit(
             "listeners",
             {"number": max(len(listeners) + delta, 0)},
             room=room_id,
@@ -157,7 +181,16 @@ class User:
     async def update_auth(self, request: web.Request) -> None:
         changed, auth = await update_auth(request, self.auth)
         if changed:
-            self.auth = auth
+            await self.set_auth(auth)
+
+    async def set_auth(self, auth: SpotifyAuth) -> None:
+        self.auth = auth
+
+        # Nothing else saves the users that are loaded outside of a context
+        # (e.g. the listeners of a fan-out) so the new token would be lost
+        # and refreshed again on the next call
+        if self._context_data is None:
+            await self.database.update_auth(self.user_id, auth)
 
     async def transfer(
         self, request: web.Request, *, play: bool = False, check: bool = True
@@ -166,6 +199,7 @@ class User:
             return False
 
         # No active device: transfer first
+        devices = request.config_dict["devices"]
         try:
             await call_api(
                 request,
@@ -175,19 +209,17 @@ class User:
                 json=dict(device_ids=[self.device_id], play=play),
             )
         except ClientResponseError as e:
-            print(f"'/me/player' returned {e.status}")
+            logger.warning(
+                "'/me/player' returned %s",
+                e.status,
+                extra={"user_id": self.user_id, "status": e.status},
+            )
+            devices.forget(self.device_id)
             return False
 
+        # Wait for the device to become active
         if check:
-            await asyncio.sleep(1)
-            response = await call_api(request, self, "/me/player/devices")
-            if response is None:
-                return False
-            return any(
-                device.get("is_active", False)
-                and (device.get("id", None) == self.device_id)
-                for device in response.json().get("devices", [])
-            )
+            return await devices.wait_until_active(request, self, force=True)
 
         return True
 
@@ -225,13 +257,17 @@ class User:
             if e.status not in (403, 404):
                 raise
 
-            flag = await self.transfer(request, play=True, check=False)
+            # The device isn't active anymore so it needs to be re-verified.
+            # The transfer polls until it is active so we can retry straight
+            # away.
+            request.config_dict["devices"].forget(self.device_id)
+            flag = await self.transfer(request, play=True, check=True)
             if flag and retries > 0:
-                await asyncio.sleep(1)
                 return await self.play(request, data, retries=retries - 1)
 
             return False
 
+        request.config_dict["devices"].mark_active(self.device_id)
         return True
 
     async def currently_playing(
@@ -246,12 +282,15 @@ class User:
         if response is None or response.status == 204:
             return None
         data = response.json()
-        item = data.get("item", {})
+        item = data.get("item", None) or {}
+        context = data.get("context", None) or {}
         return {
             "uri": item.get("uri", None),
             "name": item.get("name", None),
             "type": item.get("type", None),
             "id": item.get("id", None),
+            "duration_ms": item.get("duration_ms", None),
+            "context_uri": context.get("uri", None),
             "position_ms": data.get("progress_ms", None),
             "is_playing": data.get("is_playing", False),
         }
@@ -272,9 +311,21 @@ class User:
             and data["uri"] is not None
             and data["position_ms"] is not None
         ):
+            # In context following mode, the listener is started on the
+            # same context as the rest of the room so that they follow it on
+            # their own
+            context_uri = data.get("context_uri", None)
+            playback = request.config_dict["playback"].get(room.room_id)
+            if playback is not None and playback.uri == data["uri"]:
+                context_uri = playback.context_uri
+            elif not (
+                request.config_dict["config"]["follow_context"]
+                and is_followable(context_uri)
+            ):
+                context_uri = None
             await self.play(
                 request,
-                dict(uris=[data["uri"]], position_ms=data["position_ms"]),
+                play_payload(data["uri"], data["position_ms"], context_uri),
                 retries=retries,
             )
         else:
@@ -303,25 +354,175 @@ class Room:
         return await self.host.database.get_listeners(self.room_id)
 
     async def play(
-        self, request: web.Request, uri: str, position_ms: Optional[int] = None
+        self,
+        request: web.Request,
+        uri: str,
+        position_ms: Optional[int] = None,
+        *,
+        context_uri: Optional[str] = None,
+        duration_ms: Optional[int] = None,
+        listeners: Optional[List[Union[User, None]]] = None,
     ) -> bool:
-        data: MutableMapping[str, Any] = dict(uris=[uri])
-        if position_ms is not None:
-            data["position_ms"] = position_ms
-
-        success = True
-        for user in await self.listeners:
-            if user is None or user.paused:
-                continue
-            flag = await user.play(request, data)
-            if not flag:
-                success = False
-        return success
+        """Start playback of a track for the listeners in this room
+
+        In context following mode (the ``follow_context`` config option), if
+        the track is being played from an album or playlist, the listeners
+        are started on that context. After that, they only need to be sent a
+        command when the host switches context or jumps somewhere that the
+        listeners wouldn't have reached on their own.
+
+        The commands are sent to all of the listeners concurrently. If
+        ``listeners`` is given, those are used instead of querying the
+        database.
+
+        """
+        if not (
+            request.config_dict["config"]["follow_context"]
+            and is_followable(context_uri)
+        ):
+            context_uri = None
+
+        # Find the track that the listeners will play next on their own, and
+        # don't start them on the context if the host is playing a track
+        # that isn't in it (e.g. from their queue)
+        next_uri = None
+        states = request.config_dict["playback"]
+        if context_uri is not None:
+            tracks = await self._context_tracks(request, context_uri)
+            if tracks is not None and uri not in tracks:
+                context_uri = None
+            else:
+                next_uri = next_in_context(tracks, uri)
+
+        now = time.time()
+        previous = states.get(self.room_id)
+        playback = Playback(
+            uri,
+            context_uri,
+            now - 1e-3 * (0 if position_ms is None else position_ms),
+            duration_ms,
+            next_uri,
+        )
+        if previous is not None and previous.continues(
+            uri, context_uri, position_ms, now
+        ):
+            states.set(self.room_id, playback._replace(delivered=True))
+            return True
+        states.set(self.room_id, playback)
+
+        if listeners is None:
+            listeners = await self.listeners
+        data = play_payload(uri, position_ms, context_uri)
+        flags = await asyncio.gather(
+            *(
+                self._send(
+                    request, user, "play", partial(user.play, request, data)
+                )
+                for user in listeners
+                if user is not None and not user.paused
+            )
+        )
+
+        # Only skip the next command if this one reached every listener
+        if all(flags) and states.get(self.room_id) is playback:
+            states.set(self.room_id, playback._replace(delivered=True))
+        return all(flags)
+
+    async def _context_tracks(
+        self, request: web.Request, context_uri: str
+    ) -> Optional[Tuple[str, ...]]:
+        """The tracks in an album or playlist, or None if they're unknown"""
+        states = request.config_dict["playback"]
+        if context_uri in states.contexts:
+            return states.contexts[context_uri]
+
+        parts = context_uri.split(":")
+        if parts[-2] == "album":
+            endpoint = f"/albums/{parts[-1]}/tracks"
+            params = dict(limit=50)
+        else:
+            endpoint = f"/playlists/{parts[-1]}/tracks"
+            params = dict(limit=100, fields="items(track(uri))")
+
+        tracks: Optional[List[str]] = []
+        while tracks is not None and len(tracks) < MAX_CONTEXT_TRACKS:
+            try:
+                response = await call_api(
+                    request,
+                    self.host,
+                    endpoint,
+                    params=dict(params, offset=len(tracks)),
+                )
+            except (ClientError, asyncio.TimeoutError):
+                response = None
+            if response is None or response.status != 200:
+                tracks = None
+                break
+            items = response.json().get("items", None) or []
+            for item in items:
+                if parts[-2] != "album":
+                    item = item.get("track", None) or {}
+                tracks.append(item.get("uri", None))
+            if len(items) < params["limit"]:
+                break
+        else:
+            # Too long to load so the listeners are corrected on every track
+            tracks = None
+
+        result = None if tracks is None else tuple(tracks)
+        states.cache_context(context_uri, result)
+        return result
 
     async def pause(self, request: web.Request) -> bool:
-        flag = True
-        for user in await self.listeners:
-            if user is None or user.paused:
-                continue
-            flag &= await user.pause(request)
+        # The next update after a pause is sent as a keyframe
+        request.config_dict["room_updates"].pop(self.room_id)
+        flags = await asyncio.gather(
+            *(
+                self._send(
+                    request, user, "pause", partial(user.pause, request)
+                )
+                for user in await self.listeners
+                if user is not None and not user.paused
+            )
+        )
+        return all(flags)
+
+    async def _send(
+        self,
+        request: web.Request,
+        user: User,
+        name: str,
+        command: Callable[..., Awaitable[bool]],
+    ) -> bool:
+        """Queue a command for a listener
+
+        Returns:
+            The result of the command or ``False`` if it was superseded by a
+            newer command for the same listener
+
+        """
+        return await request.config_dict["commands"].submit(
+            user.user_id, name, partial(self._call, request, user, command)
+        )
+
+    async def _call(
+        self,
+        request: web.Request,
+        user: User,
+        command: Callable[..., Awaitable[bool]],
+    ) -> bool:
+        """Send a command to a listener unless their circuit breaker is open"""
+        breakers = request.config_dict["breakers"]
+        if not breakers.allow(user):
+            return False
+
+        # Don't spend retries on a device that has already been failing
+        retries = 0 if breakers.failures(user) else DEFAULT_RETRIES
+        try:
+            flag = await command(retries=retries)
+        except (ClientError, asyncio.TimeoutError):
+            # Error responses, connection failures, and timeouts all count as
+            # a failure so that one listener can't abort the whole fan-out
+            flag = False
+        breakers.record(user, flag)
         return flag
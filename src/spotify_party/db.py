@@ -1,21 +1,91 @@
-__all__ = ["create_tables", "Database"]
+__all__ = ["create_tables", "Database", "StorageStats"]
 
+import importlib.resources
 import pathlib
 import sqlite3
-from typing import Iterable, List, Union
+import time
+from functools import wraps
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import aiosqlite
-import pkg_resources
 from aiohttp_spotify import SpotifyAuth
 
 from .data_model import Room, User
+from .directory import RoomDirectory
+from .metrics import DB_LATENCY
+from .tracing import traced
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# The default limit on the number of parameters in a query
+SQLITE_MAX_VARIABLES = 999
+
+
+def instrumented(func: F) -> F:
+    """Trace and time the calls to a Database method"""
+    labels = (func.__name__,)
+    traced_func = traced(f"db.{func.__name__}")(func)
+
+    @wraps(func)
+    async def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await traced_func(*args, **kwargs)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, labels)
+
+    return wrapped  # type: ignore
+
+
+class StorageStats(NamedTuple):
+    """The size of the database file
+
+    Attributes:
+        timestamp (float): When this was measured
+        page_size (int): The size of each page in bytes
+        page_count (int): The number of pages in the file
+        freelist_count (int): The number of unused pages
+        auto_vacuum (int): The auto_vacuum mode (2 is incremental)
+        objects (Dict[str, int]): The size in bytes of each table and index;
+            this is empty if SQLite was built without the dbstat table
+
+    """
+
+    timestamp: float
+    page_size: int
+    page_count: int
+    freelist_count: int
+    auto_vacuum: int
+    objects: Dict[str, int]
+
+    @property
+    def size(self) -> int:
+        return self.page_size * self.page_count
+
+    @property
+    def free(self) -> int:
+        return self.page_size * self.freelist_count
 
 
 def create_tables(filename: Union[str, pathlib.Path]) -> None:
-    with open(
-        pkg_resources.resource_filename(__name__, "schema.sql"), "r"
-    ) as f:
-        schema = f.read()
+    schema = (
+        importlib.resources.files(__package__)
+        .joinpath("schema.sql")
+        .read_text()
+    )
     with sqlite3.connect(filename) as connection:
         connection.executescript(schema)
 
@@ -23,7 +93,9 @@ def create_tables(filename: Union[str, pathlib.Path]) -> None:
 class Database:
     def __init__(self, filename: Union[str, pathlib.Path]):
         self.filename = filename
+        self.directory = RoomDirectory()
 
+    @instrumented
     async def update(self, user: User) -> None:
         async with aiosqlite.connect(self.filename) as conn:
             await conn.execute(
@@ -51,6 +123,25 @@ class Database:
             )
             await conn.commit()
 
+    @instrumented
+    async def update_auth(self, user_id: str, auth: SpotifyAuth) -> None:
+        async with aiosqlite.connect(self.filename) as conn:
+            await conn.execute(
+                """UPDATE users SET
+                    access_token=?,
+                    refresh_token=?,
+                    expires_at=?
+                WHERE user_id=?""",
+                (
+                    auth.access_token,
+                    auth.refresh_token,
+                    auth.expires_at,
+                    user_id,
+                ),
+            )
+            await conn.commit()
+
+    @instrumented
     async def add_user(
         self, user_id: str, display_name: str, auth: SpotifyAuth
     ) -> Union[User, None]:
@@ -77,6 +168,7 @@ class Database:
             await conn.commit()
         return await self.get_user(user_id)
 
+    @instrumented
     async def get_user(self, user_id: Union[str, None]) -> Union[User, None]:
         if user_id is None:
             return None
@@ -86,6 +178,7 @@ class Database:
             ) as cursor:
                 return User.from_row(self, await cursor.fetchone())
 
+    @instrumented
     async def get_room(self, room_id: Union[str, None]) -> Union[Room, None]:
         if room_id is None:
             return None
@@ -95,6 +188,54 @@ class Database:
             ) as cursor:
                 return Room.from_row(self, await cursor.fetchone())
 
+    @instrumented
+    async def pause_users(
+        self, user_ids: Iterable[str]
+    ) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """Mark a batch of users as paused in a single transaction
+
+        Returns:
+            The ``(user_id, playing_to, listening_to)`` rows for the users
+            that were not already paused
+
+        """
+        user_ids = list(user_ids)
+        changed: List[Tuple[str, Optional[str], Optional[str]]] = []
+        async with aiosqlite.connect(self.filename) as conn:
+            for n in range(0, len(user_ids), SQLITE_MAX_VARIABLES):
+                end = n + SQLITE_MAX_VARIABLES
+                chunk = user_ids[n:end]
+                marks = ",".join("?" for _ in chunk)
+                async with conn.execute(
+                    f"""
+                    SELECT user_id, playing_to, listening_to FROM users
+                    WHERE paused=0 AND user_id IN ({marks})
+                    """,
+                    chunk,
+                ) as cursor:
+                    changed.extend(await cursor.fetchall())
+                await conn.execute(
+                    f"UPDATE users SET paused=1 WHERE user_id IN ({marks})",
+                    chunk,
+                )
+            await conn.commit()
+        return changed
+
+    @instrumented
+    async def get_active_user_ids(self) -> List[str]:
+        """Get the users that are marked as hosting or listening"""
+        async with aiosqlite.connect(self.filename) as conn:
+            async with conn.execute(
+                """
+                SELECT user_id FROM users
+                WHERE
+                    paused=0
+                    AND (playing_to IS NOT NULL OR listening_to IS NOT NULL)
+                """
+            ) as cursor:
+                return [row[0] async for row in cursor]
+
+    @instrumented
     async def add_room(self, host: User, room_id: str) -> str:
         async with aiosqlite.connect(self.filename) as conn:
             await conn.execute(
@@ -104,6 +245,7 @@ class Database:
             await conn.commit()
         return room_id
 
+    @instrumented
     async def get_all_rooms(self) -> Iterable:
         async with aiosqlite.connect(self.filename) as conn:
             async with conn.execute(
@@ -118,6 +260,43 @@ class Database:
             ) as cursor:
                 return await cursor.fetchall()
 
+    @instrumented
+    async def get_room_directory(
+        self, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> Iterable:
+        """Get the active rooms with their hosts and listener counts
+
+        The results are ordered by room id and ``after`` is the keyset cursor
+        for pagination.
+
+        """
+        query = """
+            SELECT
+                host.playing_to,
+                host.display_name,
+                count(listener.user_id)
+            FROM users AS host
+            LEFT JOIN users AS listener ON
+                listener.listening_to = host.playing_to
+                AND listener.paused=0
+            WHERE
+                host.playing_to IS NOT NULL
+                AND host.paused=0
+        """
+        args: Tuple = ()
+        if after is not None:
+            query += " AND host.playing_to > ?"
+            args += (after,)
+        query += " GROUP BY host.playing_to ORDER BY host.playing_to"
+        if limit is not None:
+            query += " LIMIT ?"
+            args += (limit,)
+
+        async with aiosqlite.connect(self.filename) as conn:
+            async with conn.execute(query, args) as cursor:
+                return await cursor.fetchall()
+
+    @instrumented
     async def get_listeners(
         self, room_id: Union[str, None]
     ) -> List[Union[User, None]]:
@@ -130,6 +309,7 @@ class Database:
             ) as cursor:
                 return [User.from_row(self, row) async for row in cursor]
 
+    @instrumented
     async def get_room_stats(self) -> Iterable:
         async with aiosqlite.connect(self.filename) as conn:
             async with conn.execute(
@@ -149,17 +329,152 @@ class Database:
             ) as cursor:
                 return await cursor.fetchall()
 
-    async def get_full_table(self) -> Iterable:
+    @instrumented
+    async def get_full_table(
+        self, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> Iterable:
+        return [
+            row async for row in self.iter_full_table(after=after, limit=limit)
+        ]
+
+    async def iter_full_table(
+        self, *, after: Optional[str] = None, limit: Optional[int] = None
+    ) -> AsyncGenerator[Tuple, None]:
+        """Iterate over the user table ordered by user_id
+
+        Args:
+            after (Optional[str]): Only return users with a user_id strictly
+                greater than this one. This is the keyset cursor for
+                pagination.
+            limit (Optional[int]): The maximum number of rows to return
+
+        """
+        query = """
+            SELECT
+                user_id,
+                display_name,
+                paused,
+                playing_to,
+                listening_to
+            FROM users
+        """
+        args: Tuple = ()
+        if after is not None:
+            query += " WHERE user_id > ?"
+            args += (after,)
+        query += " ORDER BY user_id"
+        if limit is not None:
+            query += " LIMIT ?"
+            args += (limit,)
+
         async with aiosqlite.connect(self.filename) as conn:
-            async with conn.execute(
+            async with conn.execute(query, args) as cursor:
+                async for row in cursor:
+                    yield row
+
+    @instrumented
+    async def delete_inactive_users(self, before: float, limit: int) -> int:
+        """Delete a batch of users that haven't been active since ``before``
+
+        The access tokens are refreshed every hour while a user is active, so
+        the token expiry is used as the time of their last activity. This
+        also covers users whose refresh token stopped working.
+
+        Returns:
+            The number of users that were deleted
+
+        """
+        async with aiosqlite.connect(self.filename) as conn:
+            cursor = await conn.execute(
                 """
-                SELECT
-                    user_id,
-                    display_name,
-                    paused,
-                    playing_to,
-                    listening_to
-                FROM users
+                DELETE FROM users WHERE user_id IN (
+                    SELECT user_id FROM users
+                    WHERE expires_at IS NULL OR expires_at < ?
+                    LIMIT ?
+                )
+                """,
+                (int(before), limit),
+            )
+            await conn.commit()
+        if cursor.rowcount:
+            self.directory.rooms_changed()
+        return cursor.rowcount
+
+    @instrumented
+    async def clear_stale_rooms(self, before: float) -> int:
+        """Clear the room ids that are no longer in use
+
+        This removes the rooms of the paused hosts who haven't been active
+        since ``before`` and then the rooms that the listeners are following
+        if they no longer exist.
+
+        Returns:
+            The number of users that were updated
+
+        """
+        async with aiosqlite.connect(self.filename) as conn:
+            hosts = await conn.execute(
                 """
-            ) as cursor:
-                return await cursor.fetchall()
+                UPDATE users SET playing_to=NULL
+                WHERE
+                    playing_to IS NOT NULL
+                    AND paused=1
+                    AND expires_at < ?
+                """,
+                (int(before),),
+            )
+            listeners = await conn.execute(
+                """
+                UPDATE users SET listening_to=NULL
+                WHERE
+                    listening_to IS NOT NULL
+                    AND listening_to NOT IN (
+                        SELECT playing_to FROM users
+                        WHERE playing_to IS NOT NULL
+                    )
+                """
+            )
+            await conn.commit()
+        if hosts.rowcount:
+            self.directory.rooms_changed()
+        elif listeners.rowcount:
+            self.directory.listeners_changed()
+        return hosts.rowcount + listeners.rowcount
+
+    @instrumented
+    async def compact(self, max_pages: int = 0) -> None:
+        """Return the free pages to the file system and update the stats
+
+        Args:
+            max_pages (int, optional): The maximum number of pages to free
+                or zero for all of them. This only has an effect if the
+                database was created with ``auto_vacuum=INCREMENTAL``.
+
+        """
+        async with aiosqlite.connect(self.filename) as conn:
+            # The sqlite3 module only steps through this pragma once (freeing
+            # a single page) unless it is run as a script
+            await conn.executescript(
+                f"PRAGMA incremental_vacuum({int(max_pages)}); ANALYZE;"
+            )
+
+    @instrumented
+    async def get_storage_stats(self) -> StorageStats:
+        async with aiosqlite.connect(self.filename) as conn:
+            pragmas = []
+            for name in (
+                "page_size",
+                "page_count",
+                "freelist_count",
+                "auto_vacuum",
+            ):
+                async with conn.execute(f"PRAGMA {name}") as cursor:
+                    pragmas.append((await cursor.fetchone())[0])
+            try:
+                async with conn.execute(
+                    "SELECT name, sum(pgsize) FROM dbstat GROUP BY name"
+                ) as cursor:
+                    objects = dict(await cursor.fetchall())
+            except sqlite3.OperationalError:
+                objects = {}
+        return StorageStats(time.time(), *pragmas, objects)
@@ -0,0 +1,129 @@
+__all__ = ["DeviceWatcher"]
+
+import asyncio
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from aiohttp import ClientError, web
+
+from .auth import call_api
+
+if TYPE_CHECKING:
+    from .data_model import User  # NOQA
+
+MAX_CACHED_DEVICES = 4096
+
+
+class DeviceWatcher:
+    """Wait for Spotify devices to become active
+
+    After a transfer, Spotify takes a moment to activate the target device.
+    Instead of sleeping for a fixed amount of time, this polls the list of
+    devices with short, growing intervals until the device is active or the
+    timeout is reached. Devices that were recently confirmed to be active are
+    cached so that they're not re-verified during a fan-out.
+
+    Args:
+        ttl (float, optional): How long (in seconds) a confirmed device is
+            trusted
+        initial_interval (float, optional): The first polling interval
+        max_interval (float, optional): The maximum polling interval
+        timeout (float, optional): The default deadline for a device to
+            become active
+
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float = 10.0,
+        initial_interval: float = 0.1,
+        max_interval: float = 0.8,
+        timeout: float = 3.0,
+    ):
+        self.ttl = ttl
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._confirmed: Dict[str, float] = {}
+
+    def is_active(self, device_id: Optional[str]) -> bool:
+        if device_id is None:
+            return False
+        confirmed = self._confirmed.get(device_id, None)
+        if confirmed is None:
+            return False
+        if time.monotonic() - confirmed > self.ttl:
+            del self._confirmed[device_id]
+            return False
+        return True
+
+    def mark_active(self, device_id: Optional[str]) -> None:
+        if device_id is None:
+            return
+        now = time.monotonic()
+        if len(self._confirmed) >= MAX_CACHED_DEVICES:
+            self._confirmed = {
+                k: v for k, v in self._confirmed.items() if now - v <= self.ttl
+            }
+        self._confirmed[device_id] = now
+
+    def forget(self, device_id: Optional[str]) -> None:
+        if device_id is not None:
+            self._confirmed.pop(device_id, None)
+
+    async def wait_until_active(
+        self,
+        request: web.Request,
+        user: "User",
+        *,
+        timeout: Optional[float] = None,
+        force: bool = False,
+    ) -> bool:
+        """Wait until the user's device is active
+
+        Args:
+            request (web.Request): The current request
+            user (User): The user who owns the device
+            timeout (Optional[float], optional): The deadline in seconds.
+                Defaults to the ``timeout`` of this watcher.
+            force (bool, optional): Poll even if the device was recently
+                confirmed, e.g. right after a transfer
+
+        Returns:
+            bool: True if the device became active before the deadline
+
+        """
+        device_id = user.device_id
+        if device_id is None:
+            return False
+        if force:
+            self.forget(device_id)
+        elif self.is_active(device_id):
+            return True
+
+        deadline = time.monotonic() + (
+            self.timeout if timeout is None else timeout
+        )
+        interval = self.initial_interval
+        while True:
+            try:
+                response = await call_api(request, user, "/me/player/devices")
+            except (ClientError, asyncio.TimeoutError):
+                return False
+            if response is None:
+                return False
+
+            if any(
+                device.get("is_active", False)
+                and (device.get("id", None) == device_id)
+                for device in response.json().get("devices", [])
+            ):
+                self.mark_active(device_id)
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(2 * interval, self.max_interval)
@@ -0,0 +1,95 @@
+__all__ = ["RoomDirectory", "etag_matches"]
+
+import secrets
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from aiohttp import web
+
+MAX_CACHED_ENTRIES = 128
+
+
+class RoomDirectory:
+    """A versioned cache for the public room directory
+
+    The list of rooms only changes when a host starts, pauses, or stops
+    broadcasting, and the listener counts only change when a listener joins or
+    leaves. These transitions are detected in ``User.__aexit__`` which calls
+    :func:`rooms_changed` or :func:`listeners_changed` after the database has
+    been updated. Anything derived from the directory (rendered pages, JSON
+    pages) is cached against the current versions.
+
+    Note that this cache is local to the process.
+
+    """
+
+    def __init__(self):
+        # This token makes sure that ETags don't collide across restarts
+        self._token = secrets.token_hex(4)
+        self.rooms_version = 0
+        self.listeners_version = 0
+        self._cache: Dict[Tuple[Hashable, int, int], Any] = {}
+
+    @property
+    def rooms_etag(self) -> str:
+        return f'"{self._token}-{self.rooms_version}"'
+
+    @property
+    def listeners_etag(self) -> str:
+        return f'"{self._token}-{self.rooms_version}-{self.listeners_version}"'
+
+    def rooms_changed(self) -> None:
+        self.rooms_version += 1
+        self._cache = {}
+
+    def listeners_changed(self) -> None:
+        self.listeners_version += 1
+        self._cache = {}
+
+    async def get(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        *,
+        listeners: bool = False,
+    ) -> Any:
+        """Get a cached value or compute it using ``factory``
+
+        Args:
+            key (Hashable): The cache key
+            factory (Callable[[], Awaitable[Any]]): A coroutine function that
+                computes the value
+            listeners (bool, optional): Should this value also be invalidated
+                when the listener counts change? Defaults to False.
+
+        """
+        versions = (
+            self.rooms_version,
+            self.listeners_version if listeners else -1,
+        )
+        full_key = (key,) + versions
+        if full_key in self._cache:
+            return self._cache[full_key]
+
+        value = await factory()
+
+        # Only cache the value if the directory didn't change while we were
+        # computing it
+        current = (
+            self.rooms_version,
+            self.listeners_version if listeners else -1,
+        )
+        if current == versions:
+            if len(self._cache) >= MAX_CACHED_ENTRIES:
+                self._cache = {}
+            self._cache[full_key] = value
+
+        return value
+
+
+def etag_matches(request: web.Request, etag: str) -> bool:
+    """Check if the request's If-None-Match header matches an ETag"""
+    header = request.headers.get("If-None-Match", None)
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
@@ -1,19 +1,25 @@
 __all__ = ["generate_room_name"]
 
+import importlib.resources
 import random
+from functools import lru_cache
+from typing import List
 
-import pkg_resources
 
-with open(
-    pkg_resources.resource_filename(__name__, "wordlists/descriptors.txt")
-) as f:
-    descriptors = ["-".join(word.strip().split()) for word in f]
-
-with open(
-    pkg_resources.resource_filename(__name__, "wordlists/genres.txt")
-) as f:
-    genres = ["-".join(word.strip().split()) for word in f]
+@lru_cache(maxsize=None)
+def load_wordlist(name: str) -> List[str]:
+    """Load one of the wordlists the first time it is needed"""
+    text = (
+        importlib.resources.files(__package__)
+        .joinpath(f"wordlists/{name}.txt")
+        .read_text()
+    )
+    return ["-".join(word.strip().split()) for word in text.splitlines()]
 
 
 def generate_room_name() -> str:
-    return random.choice(descriptors) + "-" + random.choice(genres)
+    return (
+        random.choice(load_wordlist("descriptors"))
+        + "-"
+        + random.choice(load_wordlist("genres"))
+    )
@@ -1,5 +1,6 @@
 __all__ = ["GLOBALS"]
 
+import time
 from typing import Any, Dict, cast
 
 import jinja2
@@ -18,4 +19,17 @@ def room_url(
     )
 
 
-GLOBALS = dict(room_url=room_url)
+@jinja2.contextfunction
+def static_url(context: Dict[str, Any], static_file_path: str) -> str:
+    """The URL for an asset, using its content-hashed filename if known"""
+    app = cast(web.Application, context["app"])
+    filename = app["assets"].resolve(static_file_path.lstrip("/"))
+    return "{0}/{1}".format(app["static_root_url"].rstrip("/"), filename)
+
+
+def format_time(timestamp: float) -> str:
+    """Format a UNIX timestamp in UTC"""
+    return time.strftime("%Y-%m-%d %H:%M", time.gmtime(timestamp))
+
+
+GLOBALS = dict(room_url=room_url, static=static_url, format_time=format_time)
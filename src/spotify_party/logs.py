@@ -0,0 +1,245 @@
+__all__ = ["JSONFormatter", "LogPipeline", "RateLimitFilter"]
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from . import codec
+from .metrics import LOG_DROPPED
+
+# The logger that the app's modules log to (they use ``__name__``)
+ROOT_LOGGER = "spotify_party"
+
+# The attributes that every LogRecord has; everything else was passed in
+# ``extra`` and is added to the JSON output
+STANDARD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()
+) | {"message", "asctime", "suppressed"}
+JSON_TYPES = (str, int, float, bool, type(None), list, dict)
+
+# The number of kinds of message that the rate limit keeps track of; the
+# least recently logged kinds are forgotten first
+MAX_BUCKETS = 1024
+
+# How long (in seconds) to wait for the writer thread to make room for the
+# end of the queue at shutdown
+STOP_TIMEOUT = 5.0
+
+
+class JSONFormatter(logging.Formatter):
+    """Format each record as one line of JSON
+
+    The ``extra`` fields passed to the logging call are included as is::
+
+        logger.warning("transfer failed", extra={"status": 404})
+        {"ts": 1612345678.901, "level": "WARNING",
+         "logger": "spotify_party.data_model", "msg": "transfer failed",
+         "status": 404}
+
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS:
+                data[key] = (
+                    value if isinstance(value, JSON_TYPES) else repr(value)
+                )
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return codec.dumps(data)
+
+
+class _TextFormatter(logging.Formatter):
+    """Format each record as one line of text with the suppressed count"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "over", "suppressed")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.over = 0
+        self.suppressed = 0
+
+
+class RateLimitFilter(logging.Filter):
+    """Limit the rate of each kind of message
+
+    The kind of a message is its logger and its format string (before the
+    arguments are substituted), so e.g. every failed transfer counts
+    against the same limit no matter which user it was for. Each kind can
+    be logged ``rate`` times per second on average with bursts of up to
+    ``burst``; over the limit, only one in every ``sample`` messages is kept
+    (or none if it's zero). The next message that's kept reports how many
+    were dropped in the meantime as ``suppressed``.
+
+    Only the ``MAX_BUCKETS`` most recently logged kinds are tracked so that
+    messages formatted before the logging call (which are all different)
+    can't grow the state without bound.
+
+    Args:
+        rate (float): The average number of messages per second
+        burst (int): The number of messages allowed in a burst
+        sample (int): Keep one in this many messages over the limit
+
+    """
+
+    def __init__(self, rate: float, burst: int, sample: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self._buckets: "OrderedDict[Tuple[str, Any], _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst, now)
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            bucket.tokens = min(
+                bucket.tokens + (now - bucket.updated) * self.rate, self.burst
+            )
+            bucket.updated = now
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+            else:
+                bucket.over += 1
+                if not self.sample or bucket.over % self.sample:
+                    bucket.suppressed += 1
+                    LOG_DROPPED.inc((record.name, "rate_limit"))
+                    return False
+
+            record.suppressed = bucket.suppressed
+            bucket.suppressed = 0
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments and the traceback are rendered here so that the
+        # writer thread doesn't touch any live objects, but the record is
+        # otherwise left as is so that its extra fields can be formatted
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Never block the event loop on a slow writer
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc((record.name, "queue_full"))
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The queue can be full at shutdown so wait for the writer thread to
+        # take some records off it instead of failing right away
+        self.queue.put(self._sentinel, timeout=STOP_TIMEOUT)
+
+
+class LogPipeline:
+    """Write the app's logs from a background thread
+
+    The logging calls on the event loop only filter the record, render its
+    message, and put it on a bounded queue; a listener thread formats the
+    records (as plain text or JSON) and writes them to ``stream``. When the
+    queue is full the records are dropped instead of blocking the loop. The
+    :class:`RateLimitFilter` runs before anything else so a flood of one
+    kind of message (e.g. during a Spotify outage) is cheap.
+
+    Args:
+        level (str): The minimum level to log
+        json (bool): Format the records as JSON instead of plain text
+        rate (float): See :class:`RateLimitFilter` (zero disables it)
+        burst (int): See :class:`RateLimitFilter`
+        sample (int): See :class:`RateLimitFilter`
+        queue_size (int): The maximum number of records waiting to be
+            written
+        stream (optional): The output stream. Defaults to stderr.
+
+    """
+
+    def __init__(
+        self,
+        *,
+        level: str = "INFO",
+        json: bool = False,
+        rate: float = 10.0,
+        burst: int = 50,
+        sample: int = 100,
+        queue_size: int = 10000,
+        stream: Optional[Any] = None,
+    ):
+        self.queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+        self.handler = _QueueHandler(self.queue)
+        self.handler.addFilter(RateLimitFilter(rate, burst, sample))
+
+        output = logging.StreamHandler(
+            sys.stderr if stream is None else stream
+        )
+        output.setFormatter(JSONFormatter() if json else _TextFormatter())
+        self.listener = _QueueListener(self.queue, output)
+        self.logger = logging.getLogger(ROOT_LOGGER)
+        self.level = logging.getLevelName(level.upper())
+
+    def start(self) -> None:
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(self.level)
+        self.logger.propagate = False
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Detach from the logger and write the remaining records"""
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        try:
+            self.listener.stop()
+        except queue.Full:
+            # The writer is stuck on the stream; it's a daemon thread so
+            # don't hold up the shutdown for it
+            pass
@@ -0,0 +1,106 @@
+__all__ = ["Maintenance"]
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from aiohttp import web
+
+from .db import StorageStats
+from .metrics import DB_PRUNED
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# How long to wait between the delete batches so that the other writers get
+# a chance at the database lock
+BATCH_PAUSE = 0.05
+
+# How many pages to free each time (about 4MB with the default page size)
+VACUUM_PAGES = 1000
+
+
+class Maintenance:
+    """Periodically prune and compact the database
+
+    Every user that ever logged in is kept in the users table and the hosts
+    keep their room id after they stop, so the table and its indexes only
+    grow. Each run of this job:
+
+    1. deletes the users that haven't been active for ``retention_days`` in
+       batches of ``batch_size``, with each batch in its own short
+       transaction;
+    2. clears the room ids of the paused hosts that haven't been active for
+       ``room_retention_days`` and then the listeners' room ids that no
+       longer exist;
+    3. frees some of the unused pages and updates the query planner stats;
+       and
+    4. records the size of the tables and indexes for the admin page.
+
+    Args:
+        interval (float): The time (in seconds) between runs, or zero to
+            disable the job
+        retention_days (float): How long to keep inactive users
+        room_retention_days (float): How long to keep the rooms of inactive
+            hosts
+        batch_size (int): The number of users to delete in each transaction
+        history (int, optional): The number of storage samples to keep
+
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        *,
+        retention_days: float,
+        room_retention_days: float,
+        batch_size: int,
+        history: int = 168,
+    ):
+        self.interval = interval
+        self.retention_days = retention_days
+        self.room_retention_days = room_retention_days
+        self.batch_size = batch_size
+        self.history: Deque[StorageStats] = deque(maxlen=history)
+        self.last_run: Optional[float] = None
+        self.deleted = 0
+        self.rooms_cleared = 0
+
+    async def run_once(self, app: web.Application) -> None:
+        database = app["db"]
+        now = time.time()
+
+        if self.retention_days > 0:
+            before = now - self.retention_days * DAY
+            while True:
+                deleted = await database.delete_inactive_users(
+                    before, self.batch_size
+                )
+                DB_PRUNED.inc(("users",), deleted)
+                self.deleted += deleted
+                if deleted < self.batch_size:
+                    break
+                await asyncio.sleep(BATCH_PAUSE)
+
+        if self.room_retention_days > 0:
+            cleared = await database.clear_stale_rooms(
+                now - self.room_retention_days * DAY
+            )
+            DB_PRUNED.inc(("rooms",), cleared)
+            self.rooms_cleared += cleared
+
+        await database.compact(VACUUM_PAGES)
+        self.history.append(await database.get_storage_stats())
+        self.last_run = now
+
+    async def run(self, app: web.Application) -> None:
+        self.history.append(await app["db"].get_storage_stats())
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once(app)
+            except Exception:
+                logger.exception("database maintenance failed")
@@ -0,0 +1,345 @@
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "exposition",
+    "metrics_middleware",
+    "REQUEST_LATENCY",
+    "SPOTIFY_LATENCY",
+    "DB_LATENCY",
+    "SOCKET_CONNECTED",
+    "SOCKET_EMITS",
+    "SOCKET_EMIT_BYTES",
+    "SOCKET_DROPPED",
+    "SESSION_CACHE",
+    "HTTP_CLIENT_CONNECTIONS",
+    "HTTP_CLIENT_DNS",
+    "HTTP_POOL_WAIT",
+    "COMMANDS_SUPERSEDED",
+    "PRESENCE_STALE",
+    "DB_PRUNED",
+    "ADMISSION_IN_FLIGHT",
+    "ADMISSION_QUEUED",
+    "ADMISSION_SHED",
+    "ADMISSION_WAIT",
+    "LOOP_LAG",
+    "LOOP_STALLS",
+    "LOG_DROPPED",
+    "FILE_WRITES_DROPPED",
+]
+
+import time
+from bisect import bisect_left
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+)
+
+from aiohttp import web
+
+Labels = Tuple[str, ...]
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REGISTRY: List["Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not len(names):
+        return ""
+    pairs = (
+        '{0}="{1}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"'),
+        )
+        for name, value in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        register: bool = True,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        if register:
+            REGISTRY.append(self)
+
+    def header(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+    def expose(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A monotonically increasing value for each set of label values"""
+
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def expose(self) -> Iterator[str]:
+        yield from self.header()
+        for labels, value in sorted(self._values.items()):
+            yield (
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}"
+            )
+
+
+class Gauge(Counter):
+    """A value that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self._values[labels] = value
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    """Bucketed observations for each set of label values
+
+    Observations only increment a single bucket (the cumulative counts are
+    computed when the metrics are exposed) so that ``observe`` stays cheap on
+    the hot path.
+
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Labels, _HistogramChild] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(
+                len(self.buckets) + 1
+            )
+        child.counts[bisect_left(self.buckets, value)] += 1
+        child.sum += value
+
+    def expose(self) -> Iterator[str]:
+        yield from self.header()
+        names = self.labelnames + ("le",)
+        for labels, child in sorted(self._children.items()):
+            total = 0
+            for bound, count in zip(
+                self.buckets + (float("inf"),), child.counts
+            ):
+                total += count
+                le = _format_labels(names, labels + (_format_value(bound),))
+                yield f"{self.name}_bucket{le} {total}"
+            label_str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {_format_value(child.sum)}"
+            yield f"{self.name}_count{label_str} {total}"
+
+
+REQUEST_LATENCY = Histogram(
+    "spotify_party_http_request_duration_seconds",
+    "Latency of the HTTP requests handled by each route",
+    ("route", "method", "status"),
+)
+SPOTIFY_LATENCY = Histogram(
+    "spotify_party_spotify_request_duration_seconds",
+    "Latency of the requests to each Spotify API endpoint",
+    ("endpoint", "method", "status"),
+)
+DB_LATENCY = Histogram(
+    "spotify_party_db_query_duration_seconds",
+    "Latency of each Database method",
+    ("method",),
+)
+SOCKET_CONNECTED = Gauge(
+    "spotify_party_socket_connected_sids",
+    "The number of connected socket.io clients",
+)
+SOCKET_EMITS = Counter(
+    "spotify_party_socket_emits_total",
+    "The number of socket.io events emitted by event type",
+    ("event",),
+)
+SOCKET_EMIT_BYTES = Counter(
+    "spotify_party_socket_emit_bytes_total",
+    "The number of encoded bytes queued for the room broadcasts by event",
+    ("event",),
+)
+SOCKET_DROPPED = Counter(
+    "spotify_party_socket_dropped_total",
+    "The number of events skipped for clients with a full outbound queue",
+    ("event",),
+)
+SESSION_CACHE = Counter(
+    "spotify_party_session_cache_total",
+    "The number of session cookie cache lookups by result",
+    ("result",),
+)
+HTTP_CLIENT_CONNECTIONS = Counter(
+    "spotify_party_http_client_connections_total",
+    "The number of outgoing connections created or reused by pool",
+    ("pool", "kind"),
+)
+HTTP_CLIENT_DNS = Counter(
+    "spotify_party_http_client_dns_cache_total",
+    "The number of DNS cache lookups by pool and result",
+    ("pool", "result"),
+)
+HTTP_POOL_WAIT = Histogram(
+    "spotify_party_http_client_pool_wait_seconds",
+    "Time spent waiting for a free connection when a pool is full",
+    ("pool",),
+)
+COMMANDS_SUPERSEDED = Counter(
+    "spotify_party_commands_superseded_total",
+    "The number of listener commands dropped for a newer one before sending",
+    ("command",),
+)
+PRESENCE_STALE = Counter(
+    "spotify_party_presence_stale_total",
+    "The number of disconnected users paused by the presence sweeper",
+)
+DB_PRUNED = Counter(
+    "spotify_party_db_pruned_total",
+    "The number of users deleted or stale rooms cleared by the maintenance",
+    ("kind",),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "spotify_party_admission_in_flight_requests",
+    "The number of requests being handled by priority class",
+    ("priority",),
+)
+ADMISSION_QUEUED = Gauge(
+    "spotify_party_admission_queued_requests",
+    "The number of requests waiting for a slot by priority class",
+    ("priority",),
+)
+ADMISSION_SHED = Counter(
+    "spotify_party_admission_shed_total",
+    "The number of requests rejected by admission control by class and reason",
+    ("priority", "reason"),
+)
+ADMISSION_WAIT = Histogram(
+    "spotify_party_admission_wait_seconds",
+    "Time that the queued requests waited for a slot by priority class",
+    ("priority",),
+)
+LOOP_LAG = Histogram(
+    "spotify_party_event_loop_lag_seconds",
+    "How late the event loop monitor woke up from each sleep",
+)
+LOOP_STALLS = Counter(
+    "spotify_party_event_loop_stalls_total",
+    "The number of times the event loop was blocked past the stall threshold",
+)
+LOG_DROPPED = Counter(
+    "spotify_party_log_dropped_total",
+    "The number of log records dropped by logger and reason",
+    ("logger", "reason"),
+)
+FILE_WRITES_DROPPED = Counter(
+    "spotify_party_file_writes_dropped_total",
+    "The number of trace and recording writes dropped because of a backlog",
+    ("file",),
+)
+
+
+def exposition(extra: Iterable[Metric] = ()) -> str:
+    """Render the registered metrics in the Prometheus text format"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    for metric in extra:
+        lines.extend(metric.expose())
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _route_name(request: web.Request) -> str:
+    route = request.match_info.route
+    resource = route.resource
+    if resource is None:
+        return "unmatched"
+    return resource.canonical
+
+
+@web.middleware
+async def metrics_middleware(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as ex:
+        status = ex.status
+        raise
+    finally:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            (_route_name(request), request.method, str(status)),
+        )
@@ -0,0 +1,149 @@
+__all__ = ["LoopMonitor", "task_census"]
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from .metrics import LOOP_LAG, LOOP_STALLS
+
+
+class Stall(NamedTuple):
+    timestamp: float
+    duration: float
+    stack: str
+
+
+def _task_name(task: "asyncio.Task") -> str:
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", None) or type(coro).__name__
+    frame = getattr(coro, "cr_frame", None)
+    if frame is not None:
+        name = f"{frame.f_globals.get('__name__', '?')}.{name}"
+    return name
+
+
+def task_census() -> List[Tuple[str, int]]:
+    """The number of live tasks on the current loop by coroutine name"""
+    counts = Counter(_task_name(task) for task in asyncio.all_tasks())
+    return counts.most_common()
+
+
+class LoopMonitor:
+    """Watch the event loop for blocking work
+
+    Every request, socket, and fan-out shares one event loop so anything
+    that blocks it (a large response body, a template render, a synchronous
+    write) delays every room at once. This measures that in two ways:
+
+    1. A task sleeps for ``interval`` seconds at a time and records how much
+       later than that it woke up. This lag is exported as a histogram and
+       the recent samples are kept for the admin page.
+    2. A watchdog thread checks that the task keeps waking up. When the loop
+       has been blocked for longer than ``stall_threshold`` seconds, the
+       thread captures the loop thread's stack, which points at the code
+       that is blocking it. Only one stack is captured per stall.
+
+    Args:
+        interval (float): The time (in seconds) between the lag samples
+        stall_threshold (float): How long the loop needs to be blocked for
+            a stack to be captured
+        history (int, optional): The number of stalls to keep
+        window (int, optional): The number of lag samples to keep
+
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        stall_threshold: float,
+        *,
+        history: int = 50,
+        window: int = 600,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.stalls: Deque[Stall] = deque(maxlen=history)
+        self._heartbeat = time.monotonic()
+        self._captured: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_id: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """Start sampling (this must be called from the loop's thread)"""
+        self._thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.ensure_future(self._sample())
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def summary(self) -> Dict[str, float]:
+        """The lag statistics (in seconds) over the recent samples"""
+        lags = sorted(self.lags)
+        if not lags:
+            return {"current": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "current": self.lags[-1],
+            "p50": lags[len(lags) // 2],
+            "p99": lags[min(int(0.99 * len(lags)), len(lags) - 1)],
+            "max": self.max_lag,
+        }
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            LOOP_LAG.observe(lag)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            with self._lock:
+                # The watchdog only saw the start of the stall
+                if self._captured == self._heartbeat and self.stalls:
+                    self.stalls[-1] = self.stalls[-1]._replace(duration=lag)
+                self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        poll = min(self.interval, self.stall_threshold) / 2
+        while not self._stop.wait(poll):
+            with self._lock:
+                heartbeat = self._heartbeat
+                blocked = time.monotonic() - heartbeat - self.interval
+                if blocked < self.stall_threshold:
+                    continue
+                if self._captured == heartbeat:
+                    continue
+                self._captured = heartbeat
+
+            frame = sys._current_frames().get(self._thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            with self._lock:
+                self.stalls.append(Stall(time.time(), blocked, stack))
+            LOOP_STALLS.inc()
@@ -0,0 +1,185 @@
+__all__ = [
+    "Playback",
+    "PlaybackStates",
+    "is_followable",
+    "next_in_context",
+    "play_payload",
+]
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+# How far (in seconds) the host can be from where we expect them before the
+# listeners need a correction
+DRIFT_TOLERANCE = 5.0
+
+# The number of album and playlist track lists to keep
+MAX_CACHED_CONTEXTS = 256
+
+
+def is_followable(context_uri: Optional[str]) -> bool:
+    """Can listeners be started on this context with an offset?
+
+    Spotify only supports offsets for albums and playlists.
+
+    """
+    if context_uri is None:
+        return False
+    return ":album:" in context_uri or ":playlist:" in context_uri
+
+
+def play_payload(
+    uri: str,
+    position_ms: Optional[int] = None,
+    context_uri: Optional[str] = None,
+) -> Dict[str, Any]:
+    """The body of a '/me/player/play' request for a track
+
+    If a context is given, playback starts on the context at this track so
+    that the player continues through the context on its own.
+
+    """
+    data: Dict[str, Any]
+    if context_uri is None:
+        data = dict(uris=[uri])
+    else:
+        data = dict(context_uri=context_uri, offset=dict(uri=uri))
+    if position_ms is not None:
+        data["position_ms"] = position_ms
+    return data
+
+
+def next_in_context(
+    tracks: Optional[Sequence[str]], uri: str
+) -> Optional[str]:
+    """The track that a player on this context will play after ``uri``"""
+    if tracks is None or uri not in tracks:
+        return None
+    index = tracks.index(uri) + 1
+    return tracks[index] if index < len(tracks) else None
+
+
+class Playback(NamedTuple):
+    """What the listeners in a room were last told to play
+
+    Attributes:
+        uri (str): The track URI
+        context_uri (Optional[str]): The context that the listeners were
+            started on, if they're following one
+        started_at (float): The (wall clock) time when this track was at
+            position zero
+        duration_ms (Optional[int]): The length of the track
+        next_uri (Optional[str]): The track that the listeners will move on
+            to by themselves, if they're following a context and it's known
+        delivered (bool): Did every listener get the command?
+
+    """
+
+    uri: str
+    context_uri: Optional[str]
+    started_at: float
+    duration_ms: Optional[int]
+    next_uri: Optional[str] = None
+    delivered: bool = False
+
+    @property
+    def ends_at(self) -> Optional[float]:
+        if self.duration_ms is None:
+            return None
+        return self.started_at + 1e-3 * self.duration_ms
+
+    def position_ms(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        return int(1000 * (now - self.started_at))
+
+    def in_sync(
+        self,
+        uri: str,
+        position_ms: Optional[int] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Is the host playing this track at the expected position?"""
+        now = time.time() if now is None else now
+        position = 1e-3 * (0 if position_ms is None else position_ms)
+        return (
+            uri == self.uri
+            and abs(now - position - self.started_at) < DRIFT_TOLERANCE
+        )
+
+    def continues(
+        self,
+        uri: str,
+        context_uri: Optional[str],
+        position_ms: Optional[int] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Would the listeners already be at ``uri`` without a new command?
+
+        This is only ever true if all of the listeners got the last command.
+        Then, it is true if the host is still playing the same track at the
+        expected position (e.g. the host's player reports a track that the
+        transition scheduler already sent), or, if the listeners are
+        following a context, if the host moved on to the track that follows
+        in that context at the time that the current track was expected to
+        end. If the host queued, shuffled, or skipped to a different track,
+        the listeners need to be corrected.
+
+        """
+        if not self.delivered or self.context_uri != context_uri:
+            return False
+
+        now = time.time() if now is None else now
+        if uri == self.uri:
+            return self.in_sync(uri, position_ms, now)
+        if self.context_uri is None:
+            return False
+
+        position = 1e-3 * (0 if position_ms is None else position_ms)
+        ends_at = self.ends_at
+        if uri != self.next_uri or ends_at is None:
+            return False
+        return abs(now - position - ends_at) < DRIFT_TOLERANCE
+
+
+class PlaybackStates:
+    """The most recent :class:`Playback` for each active room
+
+    This also caches the track lists of the contexts that the rooms are
+    following (``None`` if a context couldn't be loaded) so that the track
+    after the current one is known.
+
+    """
+
+    def __init__(self):
+        self._states: Dict[str, Playback] = {}
+        self.contexts: "OrderedDict[str, Optional[Tuple[str, ...]]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def items(self) -> Iterator[Tuple[str, Playback]]:
+        return iter(list(self._states.items()))
+
+    def get(self, room_id: Optional[str]) -> Optional[Playback]:
+        if room_id is None:
+            return None
+        return self._states.get(room_id, None)
+
+    def set(self, room_id: str, playback: Playback) -> None:
+        self._states[room_id] = playback
+
+    def pop(self, room_id: Optional[str]) -> Optional[Playback]:
+        if room_id is None:
+            return None
+        return self._states.pop(room_id, None)
+
+    def cache_context(
+        self, context_uri: str, tracks: Optional[Tuple[str, ...]]
+    ) -> None:
+        self.contexts[context_uri] = tracks
+        self.contexts.move_to_end(context_uri)
+        while len(self.contexts) > MAX_CACHED_CONTEXTS:
+            self.contexts.popitem(last=False)
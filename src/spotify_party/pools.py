@@ -0,0 +1,112 @@
+__all__ = ["create_session"]
+
+import time
+from types import SimpleNamespace
+
+from aiohttp import (
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    TraceConfig,
+    TraceConnectionCreateEndParams,
+    TraceConnectionQueuedEndParams,
+    TraceConnectionQueuedStartParams,
+    TraceConnectionReuseconnParams,
+    TraceDnsCacheHitParams,
+    TraceDnsCacheMissParams,
+)
+
+from .metrics import HTTP_CLIENT_CONNECTIONS, HTTP_CLIENT_DNS, HTTP_POOL_WAIT
+
+
+def trace_config(pool: str) -> TraceConfig:
+    """Record the connection reuse metrics for a pool"""
+    config = TraceConfig()
+
+    async def on_queued_start(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceConnectionQueuedStartParams,
+    ) -> None:
+        context.queued_at = time.perf_counter()
+
+    async def on_queued_end(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceConnectionQueuedEndParams,
+    ) -> None:
+        HTTP_POOL_WAIT.observe(
+            time.perf_counter() - context.queued_at, (pool,)
+        )
+
+    async def on_created(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceConnectionCreateEndParams,
+    ) -> None:
+        HTTP_CLIENT_CONNECTIONS.inc((pool, "created"))
+
+    async def on_reused(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceConnectionReuseconnParams,
+    ) -> None:
+        HTTP_CLIENT_CONNECTIONS.inc((pool, "reused"))
+
+    async def on_dns_hit(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceDnsCacheHitParams,
+    ) -> None:
+        HTTP_CLIENT_DNS.inc((pool, "hit"))
+
+    async def on_dns_miss(
+        session: ClientSession,
+        context: SimpleNamespace,
+        params: TraceDnsCacheMissParams,
+    ) -> None:
+        HTTP_CLIENT_DNS.inc((pool, "miss"))
+
+    config.on_connection_queued_start.append(on_queued_start)
+    config.on_connection_queued_end.append(on_queued_end)
+    config.on_connection_create_end.append(on_created)
+    config.on_connection_reuseconn.append(on_reused)
+    config.on_dns_cache_hit.append(on_dns_hit)
+    config.on_dns_cache_miss.append(on_dns_miss)
+    return config
+
+
+def create_session(
+    pool: str,
+    *,
+    limit: int,
+    keepalive_timeout: float = 30.0,
+    dns_cache_ttl: int = 300,
+    connect_timeout: float = 5.0,
+    timeout: float = 15.0,
+) -> ClientSession:
+    """Create a ClientSession with a dedicated connection pool
+
+    Args:
+        pool (str): The name of the pool (used to label the metrics)
+        limit (int): The maximum number of open connections; requests wait
+            for a free connection beyond this
+        keepalive_timeout (float, optional): How long to keep idle
+            connections open for reuse
+        dns_cache_ttl (int, optional): How long to cache DNS lookups
+        connect_timeout (float, optional): The timeout for getting a
+            connection (including waiting for the pool)
+        timeout (float, optional): The total timeout for each request
+
+    """
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=limit,
+        keepalive_timeout=keepalive_timeout,
+        ttl_dns_cache=dns_cache_ttl,
+    )
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=timeout, connect=connect_timeout),
+        trace_configs=[trace_config(pool)],
+    )
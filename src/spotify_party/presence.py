@@ -0,0 +1,136 @@
+__all__ = ["Presence", "PresenceSweeper", "pause_users"]
+
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from aiohttp import web
+
+from .db import Database
+from .metrics import PRESENCE_STALE
+from .socket import emit
+
+logger = logging.getLogger(__name__)
+
+
+class Presence:
+    """Which users have a connected socket
+
+    This maps the socket.io session ids to user ids so that the disconnect
+    handler doesn't need to load the (cookie) session again, and so that the
+    set of connected users can be saved when the app restarts.
+
+    """
+
+    def __init__(self):
+        self._users: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def connect(self, sid: str, user_id: str) -> None:
+        self._users[sid] = user_id
+
+    def disconnect(self, sid: str) -> Optional[str]:
+        return self._users.pop(sid, None)
+
+    def user_ids(self) -> Set[str]:
+        return set(self._users.values())
+
+
+async def pause_users(app: web.Application, user_ids: Iterable[str]) -> int:
+    """Pause a batch of users with one database write
+
+    This has the same effect as setting ``paused`` on each user, but each
+    affected room is only notified once.
+
+    Returns:
+        The number of users that were paused
+
+    """
+    database: Database = app["db"]
+    changed = await database.pause_users(user_ids)
+    if not changed:
+        return 0
+
+    hosting = {row[1] for row in changed if row[1] is not None}
+    listening = {row[2] for row in changed if row[2] is not None}
+    for room_id in sorted(hosting):
+        app["room_updates"].pop(room_id)
+        await emit("pause", room=room_id)
+    for room_id in sorted(listening):
+        listeners = await database.get_listeners(room_id)
+        await emit("listeners", {"number": len(listeners)}, room=room_id)
+
+    if hosting:
+        database.directory.rooms_changed()
+    else:
+        database.directory.listeners_changed()
+    return len(changed)
+
+
+class PresenceSweeper:
+    """Periodically pause the users that are no longer connected
+
+    The ``paused``, ``playing_to``, and ``listening_to`` columns are only
+    updated when a socket disconnects so they go stale if a disconnect is
+    lost (e.g. when the process crashes), and then every fan-out keeps
+    sending commands to users who are long gone. This compares the active
+    users in the database with the connected sockets and pauses the users
+    without one.
+
+    A user has to be missing for two sweeps in a row before they're paused
+    so that a client that is in the middle of reconnecting isn't affected.
+    The users that are expected to reconnect after a restart are left to
+    :class:`WarmRestart`.
+
+    Note that the sockets are tracked per process so this assumes that the
+    app is running in a single process, which is why it's off unless
+    ``presence_sweep_interval`` is set.
+
+    Args:
+        interval (float): The time (in seconds) between sweeps, or zero to
+            disable them
+
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.fixed = 0
+        self.last_fixed = 0
+        self.last_run: Optional[float] = None
+        self._suspects: Set[str] = set()
+
+    async def sweep(self, app: web.Application) -> int:
+        """Pause the users that have been disconnected since the last sweep
+
+        Returns:
+            The number of stale users that were fixed
+
+        """
+        restart = app["restart"]
+        if restart.draining:
+            return 0
+
+        active = await app["db"].get_active_user_ids()
+        orphans = (
+            set(active) - app["presence"].user_ids() - restart.pending_users
+        )
+        stale = orphans & self._suspects
+        self._suspects = orphans - stale
+
+        fixed = await pause_users(app, stale) if stale else 0
+        PRESENCE_STALE.inc(amount=fixed)
+        self.fixed += fixed
+        self.last_fixed = fixed
+        self.last_run = time.time()
+        return fixed
+
+    async def run(self, app: web.Application) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep(app)
+            except Exception:
+                logger.exception("presence sweep failed")
@@ -0,0 +1,181 @@
+__all__ = ["Recorder", "recording_middleware"]
+
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+
+from . import codec
+from .writer import BackgroundWriter
+
+# The request fields (and query parameters) that identify a user, a room,
+# or a device; the room ids are hashed in two parts so that a recorded
+# ``room_id`` still matches the room created by the recorded ``room_name``
+USER_FIELDS = ("room_name", "device_id")
+ROOM_FIELDS = ("room_id", "after")
+
+
+class Recorder:
+    """Record the API traffic so that it can be replayed offline
+
+    Each API request and each call to the Spotify API is appended to
+    ``filename`` as one line of JSON::
+
+        {"k": "http", "t": 1612345678.901, "path": "/api/listen/sync",
+         "route": "listen.sync", "method": "POST", "status": 200,
+         "ms": 41.2, "user": "3f2a...", "room": "9c1e.../77d0...",
+         "body": {"device_id": "b41c..."}}
+        {"k": "spotify", "t": 1612345678.912, "endpoint": "/me/player/play",
+         "method": "PUT", "status": "204", "ms": 35.7, "user": "3f2a..."}
+
+    The user, room, and device ids are replaced by a keyed hash. The key is
+    random for each recording so that the ids can't be linked across
+    recordings, but within a recording the same user always gets the same
+    id. See :mod:`spotify_party.replay` for playing a recording back.
+
+    The records are written from a background thread (see
+    :class:`spotify_party.writer.BackgroundWriter`) and dropped if it falls
+    behind.
+
+    Args:
+        filename (str): The file to append the records to
+        key (Optional[bytes], optional): The key for the hashes
+
+    """
+
+    def __init__(self, filename: str, *, key: Optional[bytes] = None):
+        self.filename = filename
+        self.count = 0
+        self._key = secrets.token_bytes(16) if key is None else key
+        self._writer: Optional[BackgroundWriter] = None
+
+    def anonymize(self, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return None
+        return hmac.new(
+            self._key, value.encode("utf-8"), hashlib.sha256
+        ).hexdigest()[:16]
+
+    def anonymize_room(self, room_id: Optional[str]) -> Optional[str]:
+        if room_id is None:
+            return None
+        user_id, _, room_name = room_id.partition("/")
+        return f"{self.anonymize(user_id)}/{self.anonymize(room_name)}"
+
+    def _anonymize_fields(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = dict(data)
+        for key in USER_FIELDS:
+            if isinstance(data.get(key), str):
+                data[key] = self.anonymize(data[key])
+        for key in ROOM_FIELDS:
+            if isinstance(data.get(key), str):
+                data[key] = self.anonymize_room(data[key])
+        return data
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._writer is None:
+            self._writer = BackgroundWriter("recording", self.filename)
+        if self._writer.write(codec.dumps_bytes(record) + b"\n"):
+            self.count += 1
+
+    def http(
+        self,
+        request: web.Request,
+        *,
+        start: float,
+        duration: float,
+        status: int,
+        body: Any,
+    ) -> None:
+        user = request.get("user")
+        record: Dict[str, Any] = {
+            "k": "http",
+            "t": round(start, 3),
+            "path": request.path,
+            "route": request.match_info.route.name,
+            "method": request.method,
+            "status": status,
+            "ms": round(1e3 * duration, 2),
+        }
+        if user is not None:
+            record["user"] = self.anonymize(user.user_id)
+            record["room"] = self.anonymize_room(
+                user.playing_to_id or user.listening_to_id
+            )
+        if isinstance(body, dict) and body:
+            record["body"] = self._anonymize_fields(body)
+        if request.query:
+            record["query"] = self._anonymize_fields(dict(request.query))
+        self._write(record)
+
+    def spotify(
+        self,
+        user_id: str,
+        endpoint: str,
+        method: str,
+        *,
+        start: float,
+        duration: float,
+        status: str,
+    ) -> None:
+        self._write(
+            {
+                "k": "spotify",
+                "t": round(start, 3),
+                "endpoint": endpoint,
+                "method": method,
+                "status": status,
+                "ms": round(1e3 * duration, 2),
+                "user": self.anonymize(user_id),
+            }
+        )
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def _record(
+    request: web.Request,
+    recorder: Recorder,
+    start: float,
+    duration: float,
+    status: int,
+) -> None:
+    # The body has already been read (and cached) by the handler
+    body = None
+    if request.body_exists:
+        try:
+            body = codec.loads(await request.read())
+        except ValueError:
+            pass
+    recorder.http(
+        request, start=start, duration=duration, status=status, body=body
+    )
+
+
+@web.middleware
+async def recording_middleware(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    recorder = request.config_dict["recorder"]
+    if recorder is None:
+        return await handler(request)
+
+    start = time.time()
+    tic = time.perf_counter()
+    try:
+        response = await handler(request)
+    except web.HTTPException as ex:
+        await _record(
+            request, recorder, start, time.perf_counter() - tic, ex.status
+        )
+        raise
+    await _record(
+        request, recorder, start, time.perf_counter() - tic, response.status
+    )
+    return response
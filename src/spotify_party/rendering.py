@@ -0,0 +1,187 @@
+__all__ = [
+    "accepts_encoding",
+    "compile_templates",
+    "setup_templates",
+    "StaticPages",
+]
+
+import gzip
+import hashlib
+import os
+import pathlib
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Union
+
+import aiohttp_jinja2
+import jinja2
+from aiohttp import web
+
+from .directory import etag_matches
+
+PathLike = Union[str, pathlib.Path]
+
+# These options change the generated code so they must be the same when the
+# templates are compiled ahead of time
+TEMPLATE_OPTIONS: Mapping[str, Any] = dict(autoescape=True)
+
+
+def get_loader(
+    template_dir: PathLike, compiled_dir: Optional[PathLike] = None
+) -> jinja2.BaseLoader:
+    """The template loader for the app
+
+    If a directory of precompiled templates (see :func:`compile_templates`)
+    is given, it takes precedence and the source templates are only used for
+    the templates that are missing from it.
+
+    """
+    loader = jinja2.FileSystemLoader(str(template_dir))
+    if compiled_dir and os.path.isdir(compiled_dir):
+        return jinja2.ChoiceLoader(
+            [jinja2.ModuleLoader(str(compiled_dir)), loader]
+        )
+    return loader
+
+
+def setup_templates(
+    app: web.Application,
+    template_dir: PathLike,
+    *,
+    debug: bool = False,
+    compiled_dir: Optional[PathLike] = None,
+) -> jinja2.Environment:
+    """Set up the templating engine
+
+    In debug mode, the templates are reloaded whenever they change. Otherwise
+    the precompiled templates are used when available, the template files
+    aren't checked for changes, and the compiled bytecode is cached on disk
+    so that new workers don't need to recompile the templates.
+
+    """
+    if debug:
+        return aiohttp_jinja2.setup(
+            app,
+            loader=jinja2.FileSystemLoader(str(template_dir)),
+            auto_reload=True,
+            **TEMPLATE_OPTIONS,
+        )
+    return aiohttp_jinja2.setup(
+        app,
+        loader=get_loader(template_dir, compiled_dir),
+        auto_reload=False,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(),
+        **TEMPLATE_OPTIONS,
+    )
+
+
+def compile_templates(template_dir: PathLike, target: PathLike) -> int:
+    """Compile the templates ahead of time into a directory of modules
+
+    Returns:
+        int: The number of compiled templates
+
+    """
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(str(template_dir)), **TEMPLATE_OPTIONS
+    )
+    compiled = []
+    env.compile_templates(
+        str(target),
+        zip=None,
+        log_function=compiled.append,
+        ignore_errors=False,
+    )
+    return sum(1 for line in compiled if line.startswith("Compiled"))
+
+
+def accepts_encoding(request: web.Request, encoding: str) -> bool:
+    """Does the request's Accept-Encoding header allow an encoding?"""
+    header = request.headers.get("Accept-Encoding", "")
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() != encoding:
+            continue
+        params = params.replace(" ", "")
+        return params not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class StaticPage(NamedTuple):
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+
+class StaticPages:
+    """Pre-rendered pages that don't depend on the request
+
+    Each page is rendered once, compressed once, and then served from memory
+    with an ETag. In debug mode, the pages are rendered for every request
+    instead.
+
+    Args:
+        env (jinja2.Environment): The template environment
+        pages (Mapping[str, Mapping[str, Any]]): The context for each page
+        debug (bool, optional): Render the pages for every request
+
+    """
+
+    def __init__(
+        self,
+        env: jinja2.Environment,
+        pages: Mapping[str, Mapping[str, Any]],
+        *,
+        debug: bool = False,
+    ):
+        self.env = env
+        self.pages = pages
+        self.debug = debug
+        self._rendered: Dict[str, StaticPage] = {}
+
+    def render(self, name: str) -> StaticPage:
+        body = (
+            self.env.get_template(name)
+            .render(**self.pages[name])
+            .encode("utf-8")
+        )
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        return StaticPage(
+            body=body,
+            gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+            etag=f'"{digest}"',
+        )
+
+    def prepare(self) -> None:
+        """Render all of the pages up front"""
+        if self.debug:
+            return
+        for name in self.pages:
+            self._rendered[name] = self.render(name)
+
+    def get(self, name: str) -> StaticPage:
+        if self.debug:
+            return self.render(name)
+        page = self._rendered.get(name, None)
+        if page is None:
+            page = self._rendered[name] = self.render(name)
+        return page
+
+    def response(self, request: web.Request, name: str) -> web.Response:
+        page = self.get(name)
+        headers = {
+            "ETag": page.etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request, page.etag):
+            return web.Response(status=304, headers=headers)
+        if accepts_encoding(request, "gzip"):
+            headers["Content-Encoding"] = "gzip"
+            body = page.gzipped
+        else:
+            body = page.body
+        return web.Response(
+            body=body,
+            content_type="text/html",
+            charset="utf-8",
+            headers=headers,
+        )
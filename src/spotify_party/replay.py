@@ -0,0 +1,400 @@
+"""Replay a traffic recording against a local server
+
+Usage::
+
+    python -m spotify_party.replay recording.ndjson [--speed 4] [--config FILE]
+
+The recording is made by setting ``record_file`` in the config (see
+:class:`spotify_party.recorder.Recorder`). Each recorded API request is sent
+to a fresh server at the same offset from the start (divided by
+``--speed``) and as the same (anonymized) user. The Spotify API is replaced
+by :class:`FakeSpotify`, which answers each endpoint with the statuses and
+latencies from the recording; these are not sped up, so a faster replay
+also means more overlapping calls. At the end, the request latencies and
+the number of Spotify calls are compared to the recording.
+
+Note that the requests are sent on schedule without waiting for the earlier
+ones, so a sped up replay can fail requests that only worked because an
+earlier one had finished (e.g. joining a room right after it was created).
+
+"""
+
+__all__ = ["FakeSpotify", "Recording", "load_recording", "replay"]
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import (
+    Any,
+    DefaultDict,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import aiohttp
+from aiohttp import ClientConnectionError, ClientResponseError, web
+from aiohttp_spotify import SpotifyAuth, SpotifyResponse
+from cryptography import fernet
+
+from . import codec
+from .app import app_factory
+from .config import get_config, validate_config
+from .db import create_tables
+
+Call = Tuple[str, str]
+
+# These are required by the config but never used by a replay
+PLACEHOLDER_CONFIG = dict(
+    spotify_client_id="replay",
+    spotify_client_secret="replay",
+    spotify_redirect_uri="http://localhost/spotify/callback",
+    base_url="http://localhost",
+    database_filename="",
+)
+
+
+class Recording(NamedTuple):
+    requests: List[Dict[str, Any]]
+    calls: List[Dict[str, Any]]
+
+
+def load_recording(filename: str) -> Recording:
+    requests = []
+    calls = []
+    with open(filename, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = codec.loads(line)
+            if record["k"] == "http":
+                requests.append(record)
+            elif record["k"] == "spotify":
+                calls.append(record)
+    requests.sort(key=lambda record: record["t"])
+    return Recording(requests, calls)
+
+
+class FakeSpotify:
+    """A stand-in for the Spotify client that answers like the recording
+
+    Each call to an endpoint takes the next status and latency recorded for
+    that endpoint (cycling through them in order), and the endpoints that
+    weren't recorded succeed right away. The responses that the app reads
+    get a plausible body: every device that the user sent is active, and the
+    same track is always playing.
+
+    Args:
+        calls (Iterable[Mapping[str, Any]]): The recorded Spotify calls
+        devices (Mapping[str, Set[str]]): The device ids for each user
+
+    """
+
+    def __init__(
+        self,
+        calls: Iterable[Mapping[str, Any]],
+        devices: Mapping[str, Set[str]],
+    ):
+        self.devices = devices
+        self.counts: "Counter[Call]" = Counter()
+        self._answers: DefaultDict[Call, List[Tuple[str, float]]] = (
+            defaultdict(list)
+        )
+        for call in calls:
+            self._answers[call["method"], call["endpoint"]].append(
+                (call["status"], call["ms"])
+            )
+        self._started = time.time()
+
+    async def update_auth(
+        self, session: aiohttp.ClientSession, auth: SpotifyAuth
+    ) -> SpotifyAuth:
+        return SpotifyAuth(
+            auth.access_token, auth.refresh_token, int(time.time()) + 3600
+        )
+
+    def _body(self, auth: SpotifyAuth, endpoint: str) -> bytes:
+        if endpoint == "/me/player/currently-playing":
+            return codec.dumps_bytes(
+                {
+                    "item": {
+                        "uri": "spotify:track:replay",
+                        "name": "Replay",
+                        "type": "track",
+                        "id": "replay",
+                        "duration_ms": 3_600_000,
+                    },
+                    "context": None,
+                    "progress_ms": int(1e3 * (time.time() - self._started)),
+                    "is_playing": True,
+                }
+            )
+        if endpoint == "/me/player/devices":
+            return codec.dumps_bytes(
+                {
+                    "devices": [
+                        {"id": device_id, "is_active": True}
+                        for device_id in self.devices.get(
+                            auth.access_token, ()
+                        )
+                    ]
+                }
+            )
+        if endpoint == "/me/player/queue":
+            return codec.dumps_bytes({"queue": []})
+        return b""
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        auth: SpotifyAuth,
+        endpoint: str,
+        *,
+        method: str = "GET",
+        **payload,
+    ) -> SpotifyResponse:
+        key = (method, endpoint)
+        answers = self._answers.get(key)
+        status, ms = "200" if method == "GET" else "204", 0.0
+        if answers:
+            status, ms = answers[self.counts[key] % len(answers)]
+        self.counts[key] += 1
+        await asyncio.sleep(1e-3 * ms)
+
+        if not status.isdigit():
+            raise ClientConnectionError(f"Recorded failure for {endpoint}")
+        code = int(status)
+        if code >= 400:
+            raise ClientResponseError(None, (), status=code)  # type: ignore
+        body = self._body(auth, endpoint) if code == 200 else b""
+        return SpotifyResponse(False, auth, code, {}, body)
+
+
+def _session_cookie(session_key: str, user_id: str) -> str:
+    # This matches the format of aiohttp_session's EncryptedCookieStorage
+    data = {"created": int(time.time()), "session": {"sp_user_id": user_id}}
+    return (
+        fernet.Fernet(session_key.encode("utf-8"))
+        .encrypt(codec.dumps_bytes(data))
+        .decode("utf-8")
+    )
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def replay(
+    recording: Recording,
+    config: Mapping[str, Any],
+    *,
+    speed: float = 1.0,
+) -> Dict[str, Any]:
+    """Replay the recorded requests against a local server
+
+    Returns:
+        The replayed latencies (in ms) and statuses for each route, and the
+        number of calls to each Spotify endpoint
+
+    """
+    devices: DefaultDict[str, Set[str]] = defaultdict(set)
+    for record in recording.requests:
+        device_id = record.get("body", {}).get("device_id")
+        if record.get("user") is not None and device_id is not None:
+            devices[record["user"]].add(device_id)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_filename = os.path.join(tmp, "replay.db")
+        create_tables(database_filename)
+
+        # There are no sockets in a replay so the sweeper would pause
+        # everyone, and the replay shouldn't be recorded
+        config = dict(
+            config,
+            database_filename=database_filename,
+            record_file="",
+            snapshot_file="",
+            presence_sweep_interval=0.0,
+            maintenance_interval=0.0,
+        )
+        app = app_factory(config)
+        spotify = FakeSpotify(recording.calls, devices)
+        app["spotify_app"]["spotify_client"] = spotify
+
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        host, port = sock.getsockname()
+        site = web.SockSite(runner, sock)
+        await site.start()
+
+        users = {r["user"] for r in recording.requests if r.get("user")}
+        cookies = {}
+        for user_id in users:
+            await app["db"].add_user(
+                user_id,
+                user_id,
+                SpotifyAuth(user_id, "replay", int(time.time()) + 86400),
+            )
+            cookies[user_id] = _session_cookie(config["session_key"], user_id)
+
+        latencies: DefaultDict[str, List[float]] = defaultdict(list)
+        statuses: DefaultDict[str, "Counter[int]"] = defaultdict(Counter)
+
+        async def send(
+            session: aiohttp.ClientSession, record: Mapping[str, Any]
+        ) -> None:
+            user_id = record.get("user")
+            tic = time.perf_counter()
+            async with session.request(
+                record["method"],
+                f"http://{host}:{port}{record['path']}",
+                params=record.get("query"),
+                data=(
+                    codec.dumps_bytes(record["body"])
+                    if "body" in record
+                    else None
+                ),
+                cookies=(
+                    {"AIOHTTP_SESSION": cookies[user_id]}
+                    if user_id in cookies
+                    else None
+                ),
+            ) as response:
+                await response.read()
+            latencies[record["route"]].append(
+                1e3 * (time.perf_counter() - tic)
+            )
+            statuses[record["route"]][response.status] += 1
+
+        try:
+            async with aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0)
+            ) as session:
+                loop = asyncio.get_event_loop()
+                origin = recording.requests[0]["t"]
+                start = loop.time()
+                tasks = []
+                for record in recording.requests:
+                    delay = (record["t"] - origin) / speed
+                    delay -= loop.time() - start
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.ensure_future(send(session, record)))
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                elapsed = loop.time() - start
+        finally:
+            # This waits for the background fan-outs to finish
+            await runner.cleanup()
+
+    return {
+        "elapsed": elapsed,
+        "failed": sum(isinstance(r, Exception) for r in results),
+        "latencies": dict(latencies),
+        "statuses": dict(statuses),
+        "spotify": dict(spotify.counts),
+    }
+
+
+def report(recording: Recording, result: Mapping[str, Any]) -> str:
+    recorded: DefaultDict[str, List[float]] = defaultdict(list)
+    recorded_statuses: DefaultDict[str, "Counter[int]"] = defaultdict(Counter)
+    for record in recording.requests:
+        recorded[record["route"]].append(record["ms"])
+        recorded_statuses[record["route"]][record["status"]] += 1
+    recorded_calls: "Counter[Call]" = Counter(
+        (call["method"], call["endpoint"]) for call in recording.calls
+    )
+    span = recording.requests[-1]["t"] - recording.requests[0]["t"]
+
+    lines = [
+        f"replayed {len(recording.requests)} requests in "
+        f"{result['elapsed']:.1f}s (recorded over {span:.1f}s); "
+        f"{result['failed']} failed to send",
+        "",
+        f"{'route':<20} {'count':>6} {'recorded p50/p95':>18} "
+        f"{'replayed p50/p95/max':>24}  statuses (recorded)",
+    ]
+    for route in sorted(recorded):
+        before = recorded[route]
+        after = result["latencies"].get(route, [])
+        replayed_statuses = result["statuses"].get(route, {})
+        statuses = ", ".join(
+            f"{status}: {replayed_statuses.get(status, 0)} "
+            f"({recorded_statuses[route][status]})"
+            for status in sorted(
+                set(replayed_statuses) | set(recorded_statuses[route])
+            )
+        )
+        lines.append(
+            f"{route:<20} {len(before):>6} "
+            f"{_percentile(before, 0.5):>8.1f}/"
+            f"{_percentile(before, 0.95):<9.1f} "
+            f"{_percentile(after, 0.5):>8.1f}/"
+            f"{_percentile(after, 0.95):.1f}/"
+            f"{max(after, default=0.0):<8.1f}  {statuses}"
+        )
+
+    lines += ["", f"{'spotify call':<40} {'recorded':>9} {'replayed':>9}"]
+    for method, endpoint in sorted(
+        set(recorded_calls) | set(result["spotify"])
+    ):
+        lines.append(
+            f"{method + ' ' + endpoint:<40} "
+            f"{recorded_calls[method, endpoint]:>9} "
+            f"{result['spotify'].get((method, endpoint), 0):>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m spotify_party.replay",
+        description="Replay a traffic recording against a local server",
+    )
+    parser.add_argument("recording", type=str)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="how much faster than the recording to send the requests",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="a config file with the settings to test (the database and "
+        "the Spotify settings are ignored)",
+    )
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("'--speed' must be positive")
+
+    recording = load_recording(args.recording)
+    if not recording.requests:
+        parser.error("the recording doesn't have any requests")
+
+    if args.config is None:
+        config = validate_config(dict(PLACEHOLDER_CONFIG))
+    else:
+        config = get_config(args.config)
+
+    result = asyncio.run(replay(recording, config, speed=args.speed))
+    print(report(recording, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+__all__ = ["WarmRestart"]
+
+import asyncio
+import gzip
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+
+from . import codec
+from .playback import Playback
+from .presence import pause_users
+
+SNAPSHOT_VERSION = 1
+
+
+class WarmRestart:
+    """Carry the room state across a restart
+
+    When the app shuts down, every socket disconnects and would normally
+    mark its user as paused, and then every client would reconnect to the
+    new process and start again from scratch. Instead, the app is put into
+    drain mode: no new broadcasts are accepted, disconnects don't touch the
+    database, and once the background tasks have flushed, the playback
+    clocks and the connected users are written to a snapshot file.
+
+    The next process loads the snapshot and gives the users ``window``
+    seconds to reconnect. A reconnect is a continuation: the rooms, the
+    listeners, and the playback clocks are exactly as they were so nothing
+    is sent to Spotify. The users that don't come back are paused in one
+    batch at the end of the window.
+
+    The hosts, listeners, and the Spotify tokens are already stored in the
+    database so only the in-memory state is part of the snapshot.
+
+    Args:
+        filename (Optional[str]): The snapshot file; drain mode still
+            rejects new broadcasts without one, but nothing is carried over
+        window (float): How long (in seconds) to wait for the reconnects
+
+    """
+
+    def __init__(self, filename: Optional[str], window: float = 60.0):
+        self.filename = filename
+        self.window = window
+        self.draining = False
+        self._pending: Set[str] = set()
+        self._deadline = 0.0
+
+    @property
+    def keeps_presence(self) -> bool:
+        """Should disconnects leave the users as they are?"""
+        return self.draining and self.filename is not None
+
+    @property
+    def pending(self) -> int:
+        """The number of users that haven't reconnected yet"""
+        return len(self._pending)
+
+    @property
+    def pending_users(self) -> Set[str]:
+        """The users that haven't reconnected yet"""
+        return set(self._pending)
+
+    def start_draining(self) -> None:
+        self.draining = True
+
+    def resume(self, user_id: str) -> bool:
+        """Claim the continuation for a user that reconnected
+
+        Returns:
+            True if the user was connected before the restart
+
+        """
+        if user_id in self._pending:
+            self._pending.discard(user_id)
+            return True
+        return False
+
+    def save(self, app: web.Application) -> None:
+        """Write the snapshot (atomically)"""
+        if self.filename is None:
+            return
+        data: Dict[str, Any] = {
+            "version": SNAPSHOT_VERSION,
+            "written_at": time.time(),
+            "playback": {
+                room_id: list(playback)
+                for room_id, playback in app["playback"].items()
+            },
+            "connected": sorted(app["presence"].user_ids() | self._pending),
+        }
+        tmp = f"{self.filename}.tmp"
+        with gzip.open(tmp, "wb") as f:
+            f.write(codec.dumps_bytes(data))
+        os.replace(tmp, self.filename)
+
+    def load(self, app: web.Application) -> None:
+        """Restore the snapshot and wait for the users to reconnect"""
+        if self.filename is None:
+            return
+        try:
+            with gzip.open(self.filename, "rb") as f:
+                data = codec.loads(f.read())
+        except FileNotFoundError:
+            return
+        finally:
+            # A snapshot is only valid for the restart that wrote it
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        if data.get("version") != SNAPSHOT_VERSION:
+            return
+
+        for room_id, playback in data["playback"].items():
+            app["playback"].set(room_id, Playback(*playback))
+
+        # If the app was down for longer than the window, nobody is coming
+        # back; this is picked up right away by the first call to ``expire``
+        self._pending = set(data["connected"])
+        elapsed = time.time() - data["written_at"]
+        self._deadline = max(self.window - elapsed, 0.0)
+
+    async def expire(self, app: web.Application) -> int:
+        """Pause the users that didn't reconnect within the window
+
+        Returns:
+            The number of users that were paused
+
+        """
+        await asyncio.sleep(self._deadline)
+        pending, self._pending = self._pending, set()
+        if not pending:
+            return 0
+        return await pause_users(app, pending)
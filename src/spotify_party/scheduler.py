@@ -0,0 +1,238 @@
+__all__ = ["TransitionScheduler"]
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional, cast
+
+from aiohttp import ClientError, web
+
+from .auth import call_api
+from .data_model import Room, User
+from .playback import Playback
+from .socket import emit
+
+logger = logging.getLogger(__name__)
+
+# How long before the predicted end of a track to prepare the fan-out
+PREPARE_LEAD = 5.0
+
+# How long before the predicted end of a track to send the commands to make up
+# for the API latency
+FIRE_LEAD = 0.15
+
+# How long after the predicted end to check the host's player once
+CONFIRM_DELAY = 2.0
+
+
+async def sleep_until(timestamp: float) -> None:
+    delay = timestamp - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class _Context:
+    """Stands in for the request in the tasks that outlive it
+
+    The data model only needs ``config_dict`` so this keeps the request (and
+    its transport and payload) from being held for the length of a track.
+
+    """
+
+    __slots__ = ("config_dict",)
+
+    def __init__(self, config_dict: Mapping[str, Any]):
+        self.config_dict = config_dict
+
+
+class TransitionScheduler:
+    """Pre-arm the listener fan-out at the predicted end of the host's track
+
+    Without this, listeners only change tracks after the host's browser
+    notices the change and posts it back to the server. Instead, once a
+    room's playback is known, this schedules a task for the end of the track
+    that:
+
+    1. shortly before the boundary, refreshes the prediction using the host's
+       player state, refreshes any listener tokens that are about to expire,
+       and looks up the next track in the host's queue;
+    2. at the boundary, sends the next track (when known) to all of the
+       listeners at once; and
+    3. checks the host's player state once shortly after the boundary and
+       corrects the listeners if the prediction was wrong.
+
+    When the host's browser reports the same change afterwards, the fan-out
+    is skipped because :func:`Room.play` sees that the listeners are already
+    there.
+
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, request: web.Request, room_id: str) -> None:
+        """Schedule the next transition for a room"""
+        self.cancel(room_id)
+        if not request.config_dict["config"]["schedule_transitions"]:
+            return
+        playback = request.config_dict["playback"].get(room_id)
+        if playback is None or playback.ends_at is None:
+            return
+        context = cast(web.Request, _Context(request.config_dict))
+        task = asyncio.ensure_future(self._run(context, room_id, playback))
+        self._tasks[room_id] = task
+        task.add_done_callback(lambda t: self._discard(room_id, t))
+
+    def cancel(self, room_id: Optional[str]) -> None:
+        if room_id is None:
+            return
+        task = self._tasks.pop(room_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def _discard(self, room_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(room_id, None) is task:
+            del self._tasks[room_id]
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _run(
+        self, request: web.Request, room_id: str, playback: Playback
+    ) -> None:
+        try:
+            await self._transition(request, room_id, playback)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(
+                "track transition failed", extra={"room_id": room_id}
+            )
+
+    async def _transition(
+        self, request: web.Request, room_id: str, playback: Playback
+    ) -> None:
+        ends_at = playback.ends_at
+        if ends_at is None:
+            return
+        await sleep_until(ends_at - PREPARE_LEAD)
+
+        # Make sure that the room is still active and refresh the prediction
+        room = await request.config_dict["db"].get_room(room_id)
+        if room is None or room.host.paused:
+            return
+        async with room.host:
+            await room.host.update_auth(request)
+        current = await room.host.currently_playing(request)
+        if current is None or not current.pop("is_playing"):
+            return
+        if current["uri"] != playback.uri:
+            # We missed a change so just catch up now
+            await self._fire(request, room, current)
+            return
+        if current["position_ms"] is not None:
+            playback = playback._replace(
+                started_at=time.time() - 1e-3 * current["position_ms"]
+            )
+        ends_at = playback.ends_at
+        if ends_at is None:
+            return
+
+        # Get the listeners ready
+        next_track = await self._next_track(request, room.host)
+        await asyncio.gather(
+            *(
+                self._refresh(request, user)
+                for user in await room.listeners
+                if user is not None and not user.paused
+            )
+        )
+
+        # Send the next track at the boundary to the listeners that are in
+        # the room by then
+        await sleep_until(ends_at - FIRE_LEAD)
+        if next_track is not None:
+            await room.play(
+                request,
+                next_track["uri"],
+                0,
+                context_uri=playback.context_uri,
+                duration_ms=next_track["duration_ms"],
+            )
+
+        # Confirm with the host and correct the listeners if the prediction
+        # was wrong
+        await sleep_until(ends_at + CONFIRM_DELAY)
+        current = await room.host.currently_playing(request)
+        if current is None or not current.pop("is_playing"):
+            return
+        states = request.config_dict["playback"]
+        latest = states.get(room_id)
+        if (
+            latest is not None
+            and latest.delivered
+            and latest.in_sync(current["uri"], current["position_ms"])
+        ):
+            if latest.duration_ms is None:
+                latest = latest._replace(duration_ms=current["duration_ms"])
+                states.set(room_id, latest)
+            self.schedule(request, room_id)
+        else:
+            await self._fire(request, room, current)
+
+    async def _fire(
+        self,
+        request: web.Request,
+        room: Room,
+        current: Mapping[str, Any],
+    ) -> None:
+        listeners = await room.listeners
+        await room.play(
+            request,
+            current["uri"],
+            current.get("position_ms", None),
+            context_uri=current.get("context_uri", None),
+            duration_ms=current.get("duration_ms", None),
+            listeners=listeners,
+        )
+        if room.room_id is None:
+            return
+        update = request.config_dict["room_updates"].update(
+            room.room_id, {"number": len(listeners), "playing": current}
+        )
+        await emit("changed", update, room=room.room_id)
+
+        # On to the next one
+        self.schedule(request, room.room_id)
+
+    async def _next_track(
+        self, request: web.Request, host: User
+    ) -> Optional[Dict[str, Any]]:
+        try:
+            response = await call_api(request, host, "/me/player/queue")
+        except (ClientError, asyncio.TimeoutError):
+            return None
+        if response is None or response.status != 200:
+            return None
+        queue = response.json().get("queue", None) or []
+        if not len(queue) or queue[0].get("uri", None) is None:
+            return None
+        return {
+            "uri": queue[0]["uri"],
+            "duration_ms": queue[0].get("duration_ms", None),
+        }
+
+    async def _refresh(self, request: web.Request, user: User) -> None:
+        try:
+            async with user:
+                await user.update_auth(request)
+        except (ClientError, asyncio.TimeoutError):
+            pass
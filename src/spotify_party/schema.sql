@@ -1,3 +1,6 @@
+-- This must come before the tables are created
+PRAGMA auto_vacuum = INCREMENTAL;
+
 CREATE TABLE users (
     user_id TEXT PRIMARY KEY,
     display_name TEXT,
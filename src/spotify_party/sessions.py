@@ -0,0 +1,143 @@
+__all__ = ["CachedEncryptedCookieStorage"]
+
+import base64
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web
+from aiohttp_session import Session
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+
+from .metrics import SESSION_CACHE
+
+SessionData = Dict[str, Any]
+
+
+class CachedEncryptedCookieStorage(EncryptedCookieStorage):
+    """An encrypted cookie storage that caches the decrypted sessions
+
+    Every request (and every socket.io connection) would otherwise decrypt
+    and parse the session cookie, even though each client sends the same
+    cookie over and over again. This keeps a bounded LRU map from a digest of
+    the cookie to the decoded session data with a TTL, so only the first
+    request with a given cookie pays for the decryption. The cookie is only
+    re-encrypted when the session data actually changed, and the new cookie
+    is added to the cache.
+
+    Since the cookies are stateless, a cached entry is exactly as valid as
+    the cookie itself; the entries never outlive the cookie's ``max_age``.
+
+    Args:
+        secret_key: The Fernet key
+        cache_size (int, optional): The maximum number of cached sessions or
+            zero to disable the cache
+        cache_ttl (float, optional): How long (in seconds) to cache each
+            session
+
+    """
+
+    def __init__(
+        self,
+        secret_key: Any,
+        *,
+        cache_size: int = 4096,
+        cache_ttl: float = 300.0,
+        **kwargs,
+    ):
+        super().__init__(secret_key, **kwargs)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[bytes, Tuple[float, SessionData]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _key(self, cookie: str) -> bytes:
+        return hashlib.blake2b(cookie.encode("utf-8"), digest_size=16).digest()
+
+    def _get(self, cookie: str) -> Optional[SessionData]:
+        key = self._key(cookie)
+        entry = self._cache.get(key, None)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires <= time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return data
+
+    def _put(self, cookie: str, data: SessionData, issued_at: float) -> None:
+        if self.cache_size <= 0:
+            return
+        now = time.monotonic()
+        expires = now + self.cache_ttl
+        if self.max_age is not None:
+            expires = min(
+                expires, now + issued_at + self.max_age - time.time()
+            )
+        key = self._key(cookie)
+        self._cache[key] = (
+            expires,
+            {"created": data["created"], "session": dict(data["session"])},
+        )
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def load_session(self, request: web.Request) -> Session:
+        cookie = self.load_cookie(request)
+        if cookie is None or self.cache_size <= 0:
+            return await super().load_session(request)
+
+        data = self._get(cookie)
+        if data is not None:
+            SESSION_CACHE.inc(("hit",))
+            return Session(None, data=data, new=False, max_age=self.max_age)
+
+        SESSION_CACHE.inc(("miss",))
+        session = await super().load_session(request)
+        if not session.new:
+            self._put(
+                cookie,
+                self._get_session_data(session),
+                _issued_at(cookie),
+            )
+        return session
+
+    async def save_session(
+        self,
+        request: web.Request,
+        response: web.StreamResponse,
+        session: Session,
+    ) -> None:
+        if session.empty:
+            return self.save_cookie(response, "", max_age=session.max_age)
+
+        # Skip the encryption if the data didn't actually change (e.g. when
+        # a value was set to its current value)
+        data = self._get_session_data(session)
+        cookie = self.load_cookie(request)
+        if (
+            cookie is not None
+            and self.max_age is None
+            and self._get(cookie) == data
+        ):
+            return
+
+        cookie = self._fernet.encrypt(
+            self._encoder(data).encode("utf-8")
+        ).decode("utf-8")
+        self.save_cookie(response, cookie, max_age=session.max_age)
+        self._put(cookie, data, time.time())
+
+
+def _issued_at(token: str) -> float:
+    # A Fernet token is a version byte followed by a 64-bit timestamp
+    raw = base64.urlsafe_b64decode(token.encode("utf-8"))
+    return float(struct.unpack(">Q", raw[1:9])[0])
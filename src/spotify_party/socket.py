@@ -1,36 +1,182 @@
-__all__ = ["sio"]
+__all__ = ["sio", "emit", "configure"]
 
-from typing import Any, Mapping
+from typing import Any, List, Mapping, Optional, Union
+from urllib.parse import parse_qs
 
 import aiohttp_session
 import socketio
+from socketio import packet
 
-sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+from .codec import SocketIOJSON
+from .metrics import (
+    SOCKET_CONNECTED,
+    SOCKET_DROPPED,
+    SOCKET_EMIT_BYTES,
+    SOCKET_EMITS,
+)
+from .tracing import span
+
+# The events that a client can miss without ending up in the wrong state,
+# since the next one (or a resync) replaces them
+DROPPABLE_EVENTS = frozenset(("changed", "listeners"))
+
+# The largest message accepted over the polling transport; the clients only
+# ever send room ids
+MAX_HTTP_BUFFER_SIZE = 64 * 1024
+
+
+class BroadcastManager(socketio.AsyncManager):
+    """A client manager that encodes each broadcast once
+
+    The default manager builds and encodes a separate packet for every
+    client in a room. The packet is the same for all of them (unless an
+    acknowledgement is requested) so here it is encoded once and the encoded
+    packet is queued for each client.
+
+    The outbound queue of each client is bounded by ``max_queue`` packets: a
+    client that can't keep up (e.g. on a bad mobile connection) misses the
+    events that are superseded by later ones instead of buffering all of
+    them in memory. A client that misses a ``changed`` update asks for the
+    full state as soon as it sees the next one.
+
+    """
+
+    # This is set by ``configure``; zero means unbounded
+    max_queue = 0
+
+    async def emit(
+        self,
+        event: str,
+        data: Any,
+        namespace: str,
+        room: Optional[str] = None,
+        skip_sid: Union[str, List[str], None] = None,
+        callback: Any = None,
+        **kwargs,
+    ) -> None:
+        if callback is not None:
+            return await super().emit(
+                event,
+                data,
+                namespace,
+                room=room,
+                skip_sid=skip_sid,
+                callback=callback,
+                **kwargs,
+            )
+        if namespace not in self.rooms or room not in self.rooms[namespace]:
+            return
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        encoded = packet.Packet(
+            packet.EVENT, namespace=namespace, data=[event] + data
+        ).encode()
+        parts = encoded if isinstance(encoded, list) else [encoded]
+        size = sum(len(part) for part in parts)
+
+        eio = self.server.eio
+        droppable = self.max_queue > 0 and event in DROPPABLE_EVENTS
+        count = 0
+        for sid in list(self.get_participants(namespace, room)):
+            if sid in skip_sid:
+                continue
+            if droppable:
+                socket = eio.sockets.get(sid, None)
+                if (
+                    socket is not None
+                    and socket.queue.qsize() >= self.max_queue
+                ):
+                    SOCKET_DROPPED.inc((event,))
+                    continue
+            count += 1
+            for n, part in enumerate(parts):
+                await eio.send(sid, part, binary=n > 0)
+        SOCKET_EMIT_BYTES.inc((event,), size * count)
+
+
+sio = socketio.AsyncServer(
+    async_mode="aiohttp",
+    cors_allowed_origins="*",
+    json=SocketIOJSON,
+    client_manager=BroadcastManager(),
+)
+
+
+def configure(config: Mapping[str, Any]) -> None:
+    """Apply the socket.io options from the app config"""
+    eio = sio.eio
+    eio.ping_interval = config["socket_ping_interval"]
+    eio.ping_timeout = config["socket_ping_timeout"]
+    eio.max_http_buffer_size = MAX_HTTP_BUFFER_SIZE
+    sio.manager.max_queue = config["socket_max_queue"]
+
+    # The websocket transport is compressed by aiohttp (permessage-deflate)
+    # when the client supports it; this is for the polling transport
+    eio.http_compression = True
+    eio.compression_threshold = config["socket_compression_threshold"]
+
+
+async def emit(event: str, data: Any = None, **kwargs) -> None:
+    """Emit an event to the connected clients (see ``AsyncServer.emit``)"""
+    SOCKET_EMITS.inc((event,))
+    with span(f"emit {event}"):
+        await sio.emit(event, data, **kwargs)
 
 
 @sio.event
 async def connect(sid: str, environ: Mapping[str, Any]) -> bool:
-    # Check that this user is authenticated
     request = environ["aiohttp.request"]
+    config = request.config_dict
+    if not config["config"]["socket_allow_polling"]:
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        if query.get("transport", ["polling"])[0] != "websocket":
+            return False
+
+    # Check that this user is authenticated
     session = await aiohttp_session.get_session(request)
     user = await request.config_dict["db"].get_user(session.get("sp_user_id"))
     if user is None:
         return False
 
+    request.config_dict["presence"].connect(sid, user.user_id)
+
+    # If the user was connected before a restart, they're still in the same
+    # state so this is a continuation
+    request.config_dict["restart"].resume(user.user_id)
+
     # Re-join the correct room if this is a re-connect
     if user.listening_to_id is not None:
         sio.enter_room(sid, user.listening_to_id)
     elif user.playing_to_id is not None:
         sio.enter_room(sid, user.playing_to_id)
 
+    # Only keep what the handlers need instead of the request and all of its
+    # headers for as long as the client is connected
+    sio.environ[sid] = {"config": config}
+
+    SOCKET_CONNECTED.inc()
     return True
 
 
 @sio.event
 async def disconnect(sid: str) -> None:
-    request = sio.environ[sid]["aiohttp.request"]
-    session = await aiohttp_session.get_session(request)
-    user = await request.config_dict["db"].get_user(session.get("sp_user_id"))
+    SOCKET_CONNECTED.dec()
+    config = sio.environ[sid]["config"]
+
+    # When the app is restarting, the user is expected to reconnect to the
+    # next process so they're left as they are (and saved in the snapshot)
+    if config["restart"].keeps_presence:
+        return
+
+    user_id = config["presence"].disconnect(sid)
+    user = await config["db"].get_user(user_id)
     if user is None:
         return
     async with user:
@@ -40,6 +186,35 @@ async def disconnect(sid: str) -> None:
 @sio.event
 async def join(sid: str, room_id: str) -> None:
     sio.enter_room(sid, room_id)
+    await resync(sid, room_id)
+
+
+@sio.event
+async def resync(sid: str, room_id: str) -> None:
+    """Send the full state of a room to a client that missed an update"""
+    config = sio.environ[sid]["config"]
+    keyframe = config["room_updates"].keyframe(room_id)
+    if keyframe is not None:
+        await emit("changed", keyframe, room=sid)
+        return
+
+    # Nothing has been sent to this room since it started or was paused (or
+    # since a restart)
+    room = await config["db"].get_room(room_id)
+    if room is not None and not room.host.paused:
+        # The track isn't known here, but the client got it when it started
+        # listening and the next update is a keyframe, so leave it be
+        listeners = await room.listeners
+        await emit("listeners", {"number": len(listeners)}, room=sid)
+        return
+
+    listeners = [] if room is None else await room.listeners
+    await emit(
+        "changed",
+        {"v": 0, "key": True, "number": len(listeners), "playing": None},
+        room=sid,
+    )
+    await emit("pause", room=sid)
 
 
 @sio.event
@@ -0,0 +1,198 @@
+__all__ = ["Tracer", "span", "traced", "tracing_middleware"]
+
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import os
+import time
+from functools import wraps
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    ContextManager,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from aiohttp import web
+
+from .writer import BackgroundWriter
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+_NULL_SPAN = contextlib.nullcontext()
+_trace_ids = itertools.count(1)
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "start", "end", "spans")
+
+    def __init__(self, name: str):
+        self.trace_id = next(_trace_ids)
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Tuple[str, float, float]] = []
+
+    @property
+    def duration(self) -> float:
+        end = time.perf_counter() if self.end is None else self.end
+        return end - self.start
+
+
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = (
+    contextvars.ContextVar("spotify_party_trace", default=None)
+)
+
+
+class Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        # Spans from background work that outlives the request are dropped
+        if self.trace.end is None:
+            self.trace.spans.append(
+                (self.name, self.start, time.perf_counter())
+            )
+
+
+def span(name: str) -> ContextManager:
+    """Time a block of code as part of the current request's trace
+
+    When tracing is disabled (or outside of a request) this returns a shared
+    no-op context manager.
+
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return Span(trace, name)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """A decorator to record each call to a coroutine function as a span"""
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        async def wrapped(*args, **kwargs):
+            if _current_trace.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapped  # type: ignore
+
+    return decorator
+
+
+class Tracer:
+    """Collect the per-request traces
+
+    Args:
+        enabled (bool, optional): Should requests be traced?
+        slow_request_ms (int, optional): Requests that take longer than this
+            are logged with a summary of their spans
+        trace_file (Optional[str], optional): If given, every trace is
+            appended to this file in the Chrome trace-event format (this can
+            be loaded into chrome://tracing or Perfetto) from a background
+            thread
+
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        slow_request_ms: int = 500,
+        trace_file: Optional[str] = None,
+    ):
+        self.enabled = enabled
+        self.slow_request = 1e-3 * slow_request_ms
+        self.trace_file = trace_file
+        self._pid = os.getpid()
+
+        # The trace-event format allows the closing bracket to be left off so
+        # that the file can be appended to
+        self._writer: Optional[BackgroundWriter] = None
+        if trace_file:
+            self._writer = BackgroundWriter("trace", trace_file, header=b"[\n")
+
+    def start(self, name: str) -> Tuple[Trace, contextvars.Token]:
+        trace = Trace(name)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, trace: Trace, token: contextvars.Token) -> None:
+        trace.end = time.perf_counter()
+        _current_trace.reset(token)
+
+        duration = trace.duration
+        if duration >= self.slow_request:
+            logger.warning(
+                "slow request: %s took %.1f ms (%s)",
+                trace.name,
+                1e3 * duration,
+                ", ".join(
+                    f"{name}: {1e3 * (end - start):.1f} ms"
+                    for name, start, end in trace.spans
+                ),
+            )
+
+        if self._writer is not None:
+            self._write(self._writer, trace)
+
+    def _write(self, writer: BackgroundWriter, trace: Trace) -> None:
+        events = [(trace.name, trace.start, trace.end)] + trace.spans
+        writer.write(
+            "".join(
+                json.dumps(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": int(1e6 * start),
+                        "dur": int(1e6 * ((end or start) - start)),
+                        "pid": self._pid,
+                        "tid": trace.trace_id,
+                    }
+                )
+                + ",\n"
+                for name, start, end in events
+            ).encode("utf-8")
+        )
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+@web.middleware
+async def tracing_middleware(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.Response:
+    tracer = request.config_dict["tracer"]
+
+    # This middleware is installed on the sub-apps too so we don't want to
+    # start a second trace
+    if not tracer.enabled or _current_trace.get() is not None:
+        return await handler(request)
+
+    trace, token = tracer.start(f"{request.method} {request.path}")
+    try:
+        return await handler(request)
+    finally:
+        tracer.finish(trace, token)
@@ -0,0 +1,81 @@
+__all__ = ["RoomUpdates"]
+
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+# Send the full state every so often so that clients that missed an update
+# catch up without asking
+KEYFRAME_INTERVAL = 16
+
+
+def _diff(old: Mapping[str, Any], new: Mapping[str, Any]) -> Dict[str, Any]:
+    """The values in ``new`` that differ from ``old``
+
+    Nested dictionaries are compared recursively and the keys that were
+    removed are set to ``None``.
+
+    """
+    delta: Dict[str, Any] = {}
+    for key, value in new.items():
+        previous = old.get(key, None)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = _diff(previous, value)
+            if nested:
+                delta[key] = nested
+        elif value != previous:
+            delta[key] = value
+    for key in old.keys() - new.keys():
+        delta[key] = None
+    return delta
+
+
+class RoomUpdates:
+    """Versioned payloads for the ``changed`` event
+
+    The host's player reports every seek and every resume, and each report
+    used to send the full track info to every listener in the room even
+    though usually only the position changed. Instead, each room keeps the
+    last state that it was sent with a version number, and the event only
+    includes what changed since the previous version::
+
+        {"v": 7, "base": 6, "playing": {"position_ms": 61000}}
+
+    Every ``keyframe_interval`` versions (and for the first update in a
+    room), the full state is sent instead::
+
+        {"v": 8, "key": true, "number": 3, "playing": {...}}
+
+    A client applies a delta only if its ``base`` is the version that the
+    client has and otherwise asks for a keyframe with the ``resync`` event.
+
+    """
+
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._states: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def update(self, room_id: str, state: Mapping[str, Any]) -> Dict[str, Any]:
+        """Record the new state for a room and get the payload to send"""
+        version, previous = self._states.get(room_id, (0, None))
+        version += 1
+        current = {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in state.items()
+        }
+        self._states[room_id] = (version, current)
+        if previous is None or version % self.keyframe_interval == 0:
+            return dict(current, v=version, key=True)
+        return dict(_diff(previous, current), v=version, base=version - 1)
+
+    def keyframe(self, room_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The full current state of a room, if known"""
+        if room_id is None or room_id not in self._states:
+            return None
+        version, current = self._states[room_id]
+        return dict(current, v=version, key=True)
+
+    def pop(self, room_id: Optional[str]) -> None:
+        if room_id is not None:
+            self._states.pop(room_id, None)
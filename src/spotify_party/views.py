@@ -1,14 +1,19 @@
-__all__ = ["routes"]
+__all__ = ["routes", "STATIC_PAGES"]
 
-from typing import Awaitable, Callable
+import asyncio
+import hmac
+from typing import Awaitable, Callable, Optional
 
 import aiohttp_jinja2
 import aiohttp_session
 from aiohttp import web
 
-from . import db
+from . import codec, db
 from .auth import require_auth
+from .directory import etag_matches
 from .generate_room_name import generate_room_name
+from .metrics import Gauge, Histogram, exposition
+from .monitor import task_census
 
 routes = web.RouteTableDef()
 
@@ -18,21 +23,29 @@ routes = web.RouteTableDef()
 #
 
 
+# These pages don't depend on the request so they are pre-rendered
+STATIC_PAGES = {
+    "splash.html": {},
+    "about.html": {"current_page": "about"},
+    "premium.html": {},
+}
+
+
 @routes.get("/", name="index")
 async def index(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template("splash.html", request, {})
+    return request.config_dict["static_pages"].response(request, "splash.html")
 
 
 @routes.get("/about/", name="about")
 async def about(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template(
-        "about.html", request, {"current_page": "about"}
-    )
+    return request.config_dict["static_pages"].response(request, "about.html")
 
 
 @routes.get("/premium/", name="premium")
 async def premium(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template("premium.html", request, {})
+    return request.config_dict["static_pages"].response(
+        request, "premium.html"
+    )
 
 
 @routes.get("/login/", name="login")
@@ -110,14 +123,24 @@ async def listen(request: web.Request, user: db.User) -> web.Response:
 @routes.get("/listen/", name="listen_index")
 @require_auth
 async def rooms(request: web.Request, user: db.User) -> web.Response:
-    rooms = await request.config_dict["db"].get_all_rooms()
-    if rooms is None:
-        return web.HTTPNotFound()
+    # The rendered directory is cached until a broadcast starts or stops
+    directory = request.config_dict["db"].directory
+    headers = {"ETag": directory.rooms_etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, directory.rooms_etag):
+        return web.Response(status=304, headers=headers)
+
+    async def render() -> str:
+        rooms = await request.config_dict["db"].get_all_rooms()
+        return aiohttp_jinja2.render_string(
+            "rooms.html",
+            request,
+            {"is_logged_in": True, "rooms": rooms, "current_page": "listen"},
+        )
 
-    return aiohttp_jinja2.render_template(
-        "rooms.html",
-        request,
-        {"is_logged_in": True, "rooms": rooms, "current_page": "listen"},
+    return web.Response(
+        text=await directory.get("rooms.html", render),
+        content_type="text/html",
+        headers=headers,
     )
 
 
@@ -130,36 +153,182 @@ async def rooms(request: web.Request, user: db.User) -> web.Response:
 @require_auth(admin=True)
 async def admin(request: web.Request, user: db.User) -> web.Response:
     stats = await request.config_dict["db"].get_room_stats()
+    tasks = request.config_dict["background_tasks"].stats
     return aiohttp_jinja2.render_template(
-        "admin.html", request, {"stats": stats}
+        "admin.html",
+        request,
+        {
+            "stats": stats,
+            "tasks": tasks,
+            "sweeper": request.config_dict["presence_sweeper"],
+        },
     )
 
 
+TABLE_COLUMNS = (
+    "user_id",
+    "display_name",
+    "paused",
+    "playing_to",
+    "listening_to",
+)
+TABLE_PAGE_SIZE = 500
+TABLE_MAX_PAGE_SIZE = 5000
+TABLE_STREAM_CHUNK = 100
+
+
 @routes.get("/admin/table/", name="admin.table")
 @require_auth(admin=True)
 async def admin_table(request: web.Request, user: db.User) -> web.Response:
-    table = await request.config_dict["db"].get_full_table()
-    return web.json_response(
+    """Export the user table
+
+    By default this returns the full table. With ``?limit=<n>`` (and
+    ``?after=<cursor>`` for the following pages), it returns one page of the
+    table along with the cursor for the next page. With ``?stream=1``, the
+    full table (starting from ``after``) is streamed as newline-delimited
+    JSON while iterating over the database cursor so that the memory usage
+    doesn't depend on the size of the table.
+    """
+    after = request.query.get("after", None)
+    limit: Optional[int] = None
+    if "limit" in request.query or after is not None:
+        try:
+            limit = min(
+                int(request.query.get("limit", TABLE_PAGE_SIZE)),
+                TABLE_MAX_PAGE_SIZE,
+            )
+        except ValueError:
+            raise web.HTTPBadRequest(text="Invalid limit")
+        if limit <= 0:
+            raise web.HTTPBadRequest(text="Invalid limit")
+
+    database = request.config_dict["db"]
+    if request.query.get("stream", "0") not in ("", "0", "false"):
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+
+        # Close the cursor (and its connection) even if the client goes away
+        rows = database.iter_full_table(after=after)
+        try:
+            chunk = []
+            async for row in rows:
+                chunk.append(codec.dumps(dict(zip(TABLE_COLUMNS, row))))
+                if len(chunk) >= TABLE_STREAM_CHUNK:
+                    chunk.append("")
+                    await response.write("\n".join(chunk).encode("utf-8"))
+                    chunk = []
+            if len(chunk):
+                chunk.append("")
+                await response.write("\n".join(chunk).encode("utf-8"))
+        finally:
+            await rows.aclose()
+
+        await response.write_eof()
+        return response
+
+    table = [
+        dict(zip(TABLE_COLUMNS, row))
+        for row in await database.get_full_table(after=after, limit=limit)
+    ]
+    if limit is None:
+        return codec.json_response({"table": table})
+    return codec.json_response(
         {
-            "table": [
-                dict(
-                    zip(
-                        [
-                            "user_id",
-                            "display_name",
-                            "paused",
-                            "playing_to",
-                            "listening_to",
-                        ],
-                        row,
-                    )
-                )
-                for row in table
-            ]
+            "table": table,
+            "next": table[-1]["user_id"] if len(table) == limit else None,
         }
     )
 
 
+@routes.get("/admin/storage/", name="admin.storage")
+@require_auth(admin=True)
+async def admin_storage(request: web.Request, user: db.User) -> web.Response:
+    """The size of the database tables and indexes over time"""
+    job = request.config_dict["maintenance"]
+    current = await request.config_dict["db"].get_storage_stats()
+    history = list(job.history) + [current]
+    return aiohttp_jinja2.render_template(
+        "admin.storage.html",
+        request,
+        {
+            "job": job,
+            "current": current,
+            "history": history[::-1],
+            "objects": sorted(current.objects),
+        },
+    )
+
+
+@routes.get("/admin/loop/", name="admin.loop")
+@require_auth(admin=True)
+async def admin_loop(request: web.Request, user: db.User) -> web.Response:
+    """The event loop lag, the live tasks, and the recent stalls"""
+    monitor = request.config_dict["loop_monitor"]
+    loop = type(asyncio.get_event_loop())
+    return aiohttp_jinja2.render_template(
+        "admin.loop.html",
+        request,
+        {
+            "monitor": monitor,
+            "summary": monitor.summary(),
+            "census": task_census(),
+            "stalls": list(monitor.stalls)[::-1],
+            "loop_type": f"{loop.__module__}.{loop.__qualname__}",
+        },
+    )
+
+
+LISTENER_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+@routes.get("/metrics", name="metrics")
+async def metrics(request: web.Request) -> web.Response:
+    """Metrics in the Prometheus text format
+
+    This is available to admins or with the ``metrics_token`` as a bearer
+    token.
+
+    """
+    token = request.config_dict["config"]["metrics_token"]
+    if token and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return await _render_metrics(request)
+    return await _admin_metrics(request)
+
+
+@require_auth(admin=True)
+async def _admin_metrics(request: web.Request, user: db.User) -> web.Response:
+    return await _render_metrics(request)
+
+
+async def _render_metrics(request: web.Request) -> web.Response:
+    # The room metrics are computed when scraped
+    rooms = await request.config_dict["db"].get_room_directory()
+    active_rooms = Gauge(
+        "spotify_party_active_rooms",
+        "The number of rooms that are broadcasting",
+        register=False,
+    )
+    active_rooms.set(len(rooms))
+    listeners = Histogram(
+        "spotify_party_room_listeners",
+        "The number of listeners in each active room",
+        buckets=LISTENER_BUCKETS,
+        register=False,
+    )
+    for row in rooms:
+        listeners.observe(row[2])
+
+    return web.Response(
+        body=exposition([active_rooms, listeners]).encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
 @routes.get("/admin/{user_id}/{room_name}/", name="admin.room")
 @require_auth(admin=True)
 async def admin_room(request: web.Request, user: db.User) -> web.Response:
@@ -172,7 +341,11 @@ async def admin_room(request: web.Request, user: db.User) -> web.Response:
     return aiohttp_jinja2.render_template(
         "admin.room.html",
         request,
-        {"room": room, "listeners": await room.listeners},
+        {
+            "room": room,
+            "listeners": await room.listeners,
+            "breakers": request.config_dict["breakers"],
+        },
     )
 
 
@@ -0,0 +1,96 @@
+__all__ = ["BackgroundWriter"]
+
+import logging
+import queue
+import threading
+from typing import Optional
+
+from .metrics import FILE_WRITES_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# How long (in seconds) to wait for the writer thread to make room for the
+# end of the queue when closing
+STOP_TIMEOUT = 5.0
+
+
+class BackgroundWriter:
+    """Append to a file from a background thread
+
+    :meth:`write` only puts the data on a bounded queue and a daemon thread
+    appends it to the file, so the event loop never waits on the disk. When
+    the queue is full, the data is dropped instead and counted in
+    ``spotify_party_file_writes_dropped_total``.
+
+    Args:
+        name (str): The name of the file in the metrics and the logs
+        filename (str): The file to append to
+        header (bytes, optional): Written first if the file is empty
+        queue_size (int, optional): The maximum number of writes waiting
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        filename: str,
+        *,
+        header: bytes = b"",
+        queue_size: int = 10000,
+    ):
+        self.name = name
+        self.filename = filename
+        self.header = header
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(queue_size)
+        self._thread: Optional[threading.Thread] = threading.Thread(
+            target=self._run, name=f"spotify_party {name} writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, data: bytes) -> bool:
+        """Queue some data to be written
+
+        Returns:
+            False if the data was dropped
+
+        """
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            FILE_WRITES_DROPPED.inc((self.name,))
+            return False
+        return True
+
+    def close(self) -> None:
+        """Write the queued data and close the file"""
+        if self._thread is None:
+            return
+        thread, self._thread = self._thread, None
+        try:
+            self._queue.put(None, timeout=STOP_TIMEOUT)
+        except queue.Full:
+            # The thread is stuck on the file; it's a daemon so don't hold up
+            # the shutdown for it
+            return
+        thread.join()
+
+    def _run(self) -> None:
+        try:
+            with open(self.filename, "ab") as f:
+                if self.header and f.tell() == 0:
+                    f.write(self.header)
+                while True:
+                    data = self._queue.get()
+                    if data is None:
+                        break
+                    f.write(data)
+                    if self._queue.empty():
+                        f.flush()
+        except OSError:
+            logger.exception(
+                "can't write the %s file",
+                self.name,
+                extra={"filename": self.filename},
+            )
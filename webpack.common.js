@@ -5,6 +5,7 @@ const { CleanWebpackPlugin } = require("clean-webpack-plugin");
 const TerserJSPlugin = require("terser-webpack-plugin");
 const OptimizeCSSAssetsPlugin = require("optimize-css-assets-webpack-plugin");
 const CopyPlugin = require("copy-webpack-plugin");
+const ManifestPlugin = require("webpack-manifest-plugin");
 
 module.exports = {
   entry: {
@@ -15,9 +16,11 @@ module.exports = {
     minimizer: [new TerserJSPlugin({}), new OptimizeCSSAssetsPlugin({})]
   },
   plugins: [
-    new MiniCssExtractPlugin(),
+    new MiniCssExtractPlugin({ filename: "[name].[contenthash:8].css" }),
     new CleanWebpackPlugin(),
-    new CopyPlugin([{ from: "./src/frontend/img", to: "." }])
+    new CopyPlugin([{ from: "./src/frontend/img", to: "." }]),
+    // Maps "bundle.js" to "bundle.<hash>.js" for the static template helper
+    new ManifestPlugin({ fileName: "manifest.json", publicPath: "" })
   ],
   module: {
     rules: [
@@ -42,7 +45,7 @@ module.exports = {
   },
   output: {
     library: "SpotifyPartyApp",
-    filename: "[name].js",
+    filename: "[name].[contenthash:8].js",
     path: path.resolve(__dirname, "./src/spotify_party/assets"),
     publicPath: "/assets"
   }
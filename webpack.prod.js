@@ -1,6 +1,29 @@
 const merge = require("webpack-merge");
 const common = require("./webpack.common.js");
 
+const CompressionPlugin = require("compression-webpack-plugin");
+
+// Pre-compress the larger assets so that the server can send them as-is
+const compressible = /\.(js|css|svg)$/;
+
 module.exports = merge(common, {
-  mode: "production"
+  mode: "production",
+  plugins: [
+    new CompressionPlugin({
+      filename: "[path].gz[query]",
+      algorithm: "gzip",
+      compressionOptions: { level: 9 },
+      test: compressible,
+      threshold: 1024,
+      minRatio: 0.8
+    }),
+    new CompressionPlugin({
+      filename: "[path].br[query]",
+      algorithm: "brotliCompress",
+      compressionOptions: { level: 11 },
+      test: compressible,
+      threshold: 1024,
+      minRatio: 0.8
+    })
+  ]
 });